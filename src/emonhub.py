@@ -20,6 +20,8 @@ import pprint
 import emonhub_setup as ehs
 import interfacers.emonhub_interfacer as ehi
 import emonhub_coder as ehc
+import emonhub_reactor as ehr
+import emonhub_process as ehp
 
 import interfacers.EmonHubSerialInterfacer
 import interfacers.EmonHubJeeInterfacer
@@ -29,6 +31,8 @@ import interfacers.EmonHubMqttInterfacer
 import interfacers.EmonHubTesterInterfacer
 import interfacers.EmonHubCommandInterfacer
 import interfacers.EmonHubEmoncmsHTTPInterfacer
+import interfacers.EmonHubDeadbandInterfacer
+import interfacers.EmonHubAggregateInterfacer
 
 ehi.EmonHubSerialInterfacer = interfacers.EmonHubSerialInterfacer.EmonHubSerialInterfacer
 ehi.EmonHubJeeInterfacer = interfacers.EmonHubJeeInterfacer.EmonHubJeeInterfacer
@@ -38,6 +42,8 @@ ehi.EmonHubMqttInterfacer = interfacers.EmonHubMqttInterfacer.EmonHubMqttInterfa
 ehi.EmonHubTesterInterfacer = interfacers.EmonHubTesterInterfacer.EmonHubTesterInterfacer
 ehi.EmonHubCommandInterfacer = interfacers.EmonHubCommandInterfacer.EmonHubCommandInterfacer
 ehi.EmonHubEmoncmsHTTPInterfacer = interfacers.EmonHubEmoncmsHTTPInterfacer.EmonHubEmoncmsHTTPInterfacer
+ehi.EmonHubDeadbandInterfacer = interfacers.EmonHubDeadbandInterfacer.EmonHubDeadbandInterfacer
+ehi.EmonHubAggregateInterfacer = interfacers.EmonHubAggregateInterfacer.EmonHubAggregateInterfacer
 
 """class EmonHub
 
@@ -76,6 +82,12 @@ class EmonHub(object):
         # Initialize Interfacers
         self._interfacers = {}
 
+        # Run the interfacers in their own threads (default) or from a reactor
+        self._reactor = None
+        if 'runtime' in settings['hub'] and settings['hub']['runtime'] == 'reactor':
+            self._log.info("Running interfacers from a reactor")
+            self._reactor = ehr.EmonHubReactor()
+
         # Update settings
         self._update_settings(settings)
         
@@ -101,12 +113,15 @@ class EmonHub(object):
             # For all Interfacers
             for I in self._interfacers.itervalues():
                 # Check thread is still running
-                if not I.isAlive():
+                if not I.isAlive() and not (self._reactor and I in self._reactor):
                     #I.start()
                     self._log.warning(I.name + " thread is dead") # had to be restarted")
 
-            # Sleep until next iteration
-            time.sleep(0.2)
+            # Sleep until next iteration, running the reactor meanwhile
+            if self._reactor:
+                self._reactor.poll(0.2)
+            else:
+                time.sleep(0.2)
          
     def close(self):
         """Close hub. Do some cleanup before leaving."""
@@ -115,7 +130,10 @@ class EmonHub(object):
 
         for I in self._interfacers.itervalues():
             I.stop = True
-            I.join()
+            if I.isAlive():
+                I.join()
+        if self._reactor:
+            self._reactor.close()
 
         self._log.info("Exit completed")
         logging.shutdown()
@@ -170,11 +188,15 @@ class EmonHub(object):
                     if not 'Type' in I:
                         continue
                     self._log.info("Creating " + I['Type'] + " '%s' ", name)
-                    # This gets the class from the 'Type' string
-                    interfacer = getattr(ehi, I['Type'])(name, **I['init_settings'])
+                    if 'process' in I and str(I['process']).lower() in ['yes', 'true', '1']:
+                        # Run the interfacer in a child process
+                        interfacer = ehp.EmonHubProcessInterfacer(name, I['Type'], **I['init_settings'])
+                    else:
+                        # This gets the class from the 'Type' string
+                        interfacer = getattr(ehi, I['Type'])(name, **I['init_settings'])
                     interfacer.set(**I['runtimesettings'])
                     interfacer.init_settings = I['init_settings']
-                    interfacer.start()
+                    self._start_interfacer(interfacer)
                 except ehi.EmonHubInterfacerInitError as e:
                     # If interfacer can't be created, log error and skip to next
                     self._log.error("Failed to create '" + name + "' interfacer: " + str(e))
@@ -191,7 +213,19 @@ class EmonHub(object):
                     self._interfacers[name].set(**I['runtimesettings'])
 
         if 'nodes' in settings:
-            ehc.nodelist = settings['nodes']
+            ehc.update_nodelist(settings['nodes'])
+            # Interfacers in child processes have their own copy of the registry
+            for I in self._interfacers.itervalues():
+                if isinstance(I, ehp.EmonHubProcessInterfacer):
+                    I.update_nodes(settings['nodes'])
+
+    def _start_interfacer(self, interfacer):
+        """Run an interfacer from the reactor if possible, otherwise in its own thread."""
+
+        if self._reactor is not None and interfacer._reactor_fds() is not None:
+            self._reactor.add(interfacer)
+        else:
+            interfacer.start()
 
     def _set_logging_level(self, level='WARNING', log=True):
         """Set logging level.
@@ -0,0 +1,128 @@
+"""
+
+  This code is released under the GNU Affero General Public License.
+
+  OpenEnergyMonitor project:
+  http://openenergymonitor.org
+
+"""
+
+import threading
+import collections
+
+"""class EmonHubQueue
+
+A bounded queue of cargos published to a subscriber.
+
+Publishers put cargos on the queues of the channel's subscribers, each
+subscriber takes them off from its own thread. What happens when a queue
+is full depends on its overflow policy:
+
+    'block'       the publisher waits for space
+    'dropoldest'  the oldest queued cargo is dropped (default)
+    'dropnewest'  the cargo being published is dropped
+    'coalesce'    a queued cargo from the same node is replaced by the new
+                  one, if there is none the oldest cargo is dropped
+
+"""
+
+# Overflow policies
+POLICIES = ['block', 'dropoldest', 'dropnewest', 'coalesce']
+
+# Default queue size
+QUEUE_SIZE = 1000
+
+
+class EmonHubQueue(object):
+
+    def __init__(self, maxsize=QUEUE_SIZE, overflow='dropoldest'):
+
+        self._queue = collections.deque()
+        self._cond = threading.Condition(threading.Lock())
+        self._closed = False
+
+        self.maxsize = int(maxsize)
+        self.overflow = overflow
+
+        # Counters
+        self.maxdepth = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._queue)
+
+    def configure(self, maxsize, overflow):
+        """Change the queue size and overflow policy."""
+
+        with self._cond:
+            self.maxsize = int(maxsize)
+            self.overflow = overflow
+            # Let any blocked publisher recheck
+            self._cond.notify_all()
+
+    def put(self, cargo):
+        """Queue a cargo, applying the overflow policy if the queue is full.
+
+        Return True if the queue was empty (the subscriber may need waking).
+
+        """
+
+        with self._cond:
+            while len(self._queue) >= self.maxsize and not self._closed:
+                if self.overflow == 'block':
+                    # Wake regularly in case the subscriber has gone
+                    self._cond.wait(1.0)
+                    continue
+                if self.overflow == 'dropnewest':
+                    self.dropped += 1
+                    return False
+                if self.overflow == 'coalesce':
+                    for i in range(len(self._queue) - 1, -1, -1):
+                        if self._queue[i].nodeid == cargo.nodeid:
+                            self._queue[i] = cargo
+                            self.coalesced += 1
+                            return False
+                self._queue.popleft()
+                self.dropped += 1
+
+            if self._closed:
+                self.dropped += 1
+                return False
+
+            self._queue.append(cargo)
+            if len(self._queue) > self.maxdepth:
+                self.maxdepth = len(self._queue)
+            self._cond.notify_all()
+            return len(self._queue) == 1
+
+    def get_all(self):
+        """Take every queued cargo off the queue, oldest first."""
+
+        with self._cond:
+            cargos = list(self._queue)
+            self._queue.clear()
+            # Make space for any blocked publisher
+            self._cond.notify_all()
+        return cargos
+
+    def wait(self, timeout):
+        """Wait up to timeout seconds for a cargo to be queued."""
+
+        with self._cond:
+            if not self._queue and not self._closed:
+                self._cond.wait(timeout)
+
+    def close(self):
+        """Stop accepting cargos, releasing any blocked publisher."""
+
+        with self._cond:
+            self._closed = True
+            self._queue.clear()
+            self._cond.notify_all()
+
+    def stats(self):
+        """Return the queue's counters as a dict."""
+
+        return {'depth': len(self._queue), 'maxdepth': self.maxdepth,
+                'dropped': self.dropped, 'coalesced': self.coalesced}
@@ -1,7 +1,25 @@
 import struct
+import logging
+import collections
 
-# Initialize nodes data
-nodelist = {}
+try:
+    import numpy as np
+except ImportError:
+    # NumPy is optional, batches are then decoded one frame at a time
+    np = None
+
+
+# Cache of precompiled struct formats, keyed by format string
+_structs = {}
+
+# Cache of NumPy structured dtypes, keyed by struct format string
+_dtypes = {}
+
+# NumPy equivalents of the (standard size, little-endian) datacodes
+_numpy_codes = {'b': 'i1', 'h': '<i2', 'i': '<i4', 'l': '<i4', 'q': '<i8', 'f': '<f4', 'd': '<f8',
+                'B': 'u1', 'H': '<u2', 'I': '<u4', 'L': '<u4', 'Q': '<u8', 'c': 'S1', '?': '?'}
+
+_log = logging.getLogger("EmonHub")
 
 
 def check_datacode(datacode):
@@ -18,6 +36,438 @@ def check_datacode(datacode):
         return False
 
 
+def get_struct(fmt):
+    """Return a precompiled struct.Struct for fmt, compiling it only once."""
+
+    s = _structs.get(fmt)
+    if s is None:
+        s = _structs[fmt] = struct.Struct(fmt)
+    return s
+
+
+def get_dtype(fmt):
+    """Return a NumPy structured dtype matching a little-endian struct format."""
+
+    dt = _dtypes.get(fmt)
+    if dt is None:
+        fields = []
+        # expand repeat counts (eg '<12h') into one field per value
+        codes = ''
+        count = ''
+        for c in fmt.lstrip('<'):
+            if c.isdigit():
+                count += c
+            else:
+                codes += c * int(count or 1)
+                count = ''
+        for i, code in enumerate(codes):
+            fields.append(('v' + str(i), _numpy_codes[code]))
+        dt = _dtypes[fmt] = np.dtype(fields)
+    return dt
+
+
+def decode_batch(frame, buf, count, factors):
+    """Decode 'count' consecutive frames of the same layout in one pass.
+
+    frame (struct.Struct): layout of a single frame
+    buf (bytearray): the frames' bytes, back to back
+    factors (sequence): per value scale factors (None = unscaled)
+
+    Return a list of lists of decoded and scaled values.
+
+    """
+
+    if np is None:
+        frames = []
+        for i in range(count):
+            frames.append(scale_values(list(frame.unpack_from(buf, i * frame.size)), factors))
+        return frames
+
+    rec = np.frombuffer(buf, dtype=get_dtype(frame.format), count=count)
+    columns = []
+    for i, name in enumerate(rec.dtype.names):
+        x = factors[i]
+        if x is None:
+            columns.append(rec[name].tolist())
+            continue
+        # Scale the whole column, returning whole numbers as ints
+        val = rec[name].astype(np.float64) * x
+        if rec[name].dtype.kind in 'iu' and rec[name].dtype.itemsize == 8:
+            # 'q' & 'Q' values can scale beyond int64, convert them as Python ints
+            columns.append([int(v) if v % 1 == 0 else v for v in val.tolist()])
+            continue
+        col = val.astype(object)
+        whole = np.nonzero(val % 1 == 0)[0]
+        col[whole] = val[whole].astype(np.int64).astype(object)
+        columns.append(col.tolist())
+    return [list(values) for values in zip(*columns)]
+
+
+def scale_factor(scale):
+    """Return a scale setting as a float factor, or None if the value is unscaled."""
+
+    if str(scale) == "1":
+        return None
+    return float(scale)
+
+
+def scale_values(values, factors):
+    """Scale a list of values in place by a sequence of factors (None = unscaled).
+
+    Scaled values that are whole numbers are returned as ints.
+
+    """
+
+    for i, x in enumerate(factors):
+        if x is not None:
+            val = values[i] * x
+            if val % 1 == 0:
+                values[i] = int(val)
+            else:
+                values[i] = float(val)
+    return values
+
+
+def deadband(setting):
+    """Return a deadband setting as (band, relative).
+
+    A setting ending in '%' is relative to the last value sent, eg '2%' is
+    (0.02, True), otherwise it is an absolute amount, eg '0.5' is (0.5, False).
+
+    """
+
+    setting = str(setting).strip()
+    if setting.endswith('%'):
+        band = (abs(float(setting[:-1])) / 100, True)
+    else:
+        band = (abs(float(setting)), False)
+    return band
+
+
+# How values are aggregated over a window by a EmonHubAggregateInterfacer
+AGGREGATES = ['mean', 'min', 'max', 'last', 'energy']
+
+
+def aggregate(setting):
+    """Return an aggregate setting checked against AGGREGATES."""
+
+    method = str(setting).strip().lower()
+    if method not in AGGREGATES:
+        raise ValueError("invalid aggregate '" + method + "'")
+    return method
+
+
+def describe_scales(factors):
+    """Return scale factors as a list for logging, with unscaled values as 1."""
+
+    return [1 if x is None else x for x in factors]
+
+
+class EmonHubNodePlan(object):
+    """Node settings for one direction ('rx' or 'tx'), compiled once per reload.
+
+    datacodes (string): per value datacodes or None, with the frame 'struct'
+        and its 'size' in bytes precompiled
+    datacode (string): default datacode for all values or None
+    scales (tuple): per value scale factors (None = unscaled) or None
+    scale (float): default scale factor for all values, None if unscaled
+    hasscale (bool): True if a default scale is set for the node
+    deadbands (tuple): per value deadbands, each (band, relative), or None
+    deadband (tuple): default deadband for all values or None
+    aggregates (tuple): per value aggregates (see AGGREGATES) or None
+    aggregate (string): default aggregate for all values or None
+
+    Settings left as None fall back to the interfacer's defaults.
+
+    A bad deadband or aggregate setting only concerns the interfacers
+    using it, so it is dropped on its own, listed in 'ignored', rather
+    than raising ValueError and losing how the node's frames are decoded.
+
+    """
+
+    def __init__(self, spec):
+
+        self.datacodes = None
+        self.datacode = None
+        self.struct = None
+        self.size = 0
+        self.scales = None
+        self.scale = None
+        self.hasscale = False
+        self.deadbands = None
+        self.deadband = None
+        self.aggregates = None
+        self.aggregate = None
+        self.ignored = []
+
+        if 'datacodes' in spec:
+            codes = ''.join([str(c).strip() for c in spec['datacodes']])
+            for code in codes:
+                if not check_datacode(code):
+                    raise ValueError("invalid datacode '" + code + "'")
+            self.datacodes = codes
+            self.struct = get_struct('<' + codes)
+            self.size = self.struct.size
+        elif 'datacode' in spec:
+            code = str(spec['datacode'])
+            if code != '0' and not check_datacode(code):
+                raise ValueError("invalid datacode '" + code + "'")
+            self.datacode = code
+
+        if 'scales' in spec:
+            self.scales = tuple([scale_factor(x) for x in spec['scales']])
+        elif 'scale' in spec:
+            self.scale = scale_factor(spec['scale'])
+            self.hasscale = True
+
+        try:
+            if 'deadbands' in spec:
+                self.deadbands = tuple([deadband(x) for x in _as_tuple(spec['deadbands'])])
+            elif 'deadband' in spec:
+                self.deadband = deadband(spec['deadband'])
+        except ValueError as e:
+            self.ignored.append("deadband: " + str(e))
+
+        try:
+            if 'aggregates' in spec:
+                self.aggregates = tuple([aggregate(x) for x in _as_tuple(spec['aggregates'])])
+            elif 'aggregate' in spec:
+                self.aggregate = aggregate(spec['aggregate'])
+        except ValueError as e:
+            self.ignored.append("aggregate: " + str(e))
+
+    def frame_struct(self, datacode, length):
+        """Return the struct for a frame of 'length' bytes of a single datacode.
+
+        Returns None if length is not a multiple of the datacode size.
+
+        """
+
+        size = check_datacode(datacode)
+        if not size or length % size:
+            return None
+        return get_struct('<' + str(length // size) + datacode)
+
+
+# Plan used for nodes that are not listed, all interfacer defaults
+default_plan = EmonHubNodePlan({})
+
+
+class EmonHubTxPlan(object):
+    """A node's tx plan resolved against an interfacer's default settings.
+
+    Plans are cached by the registry, so interfacers with identical
+    settings share the same plan object and therefore the same encoding.
+
+    """
+
+    def __init__(self, dest, plan, datacode, scale):
+
+        self.dest = dest
+        self.datacodes = plan.datacodes
+        self.struct = plan.struct
+
+        # Resolve the default datacode & scale from the interfacer's settings
+        self.datacode = plan.datacode
+        if self.datacode is None:
+            self.datacode = str(datacode)
+        if self.datacodes is None and self.datacode != '0' and not check_datacode(self.datacode):
+            raise ValueError("invalid datacode '" + self.datacode + "'")
+        self.scales = plan.scales
+        if plan.hasscale:
+            self.scale = plan.scale
+        else:
+            self.scale = scale_factor(scale)
+
+    def key(self):
+        """Return a key identifying the encoding this plan produces."""
+
+        if self.datacodes is not None:
+            datacode = self.datacodes
+        else:
+            datacode = self.datacode
+        if self.scales is not None:
+            scale = self.scales
+        else:
+            scale = self.scale
+        return (self.dest, datacode, scale)
+
+    def encode(self, values):
+        """Scale and encode a list of real values for transmission.
+
+        Return a list of the destination followed by the encoded values
+        (byte values, or plain numbers if datacode is '0').
+        Raise ValueError if the values don't suit the node's settings.
+
+        """
+
+        # Scale down the values
+        if self.scales is not None:
+            if len(values) != len(self.scales):
+                raise ValueError("Scales " + str(describe_scales(self.scales)) + " for TX data : " +
+                                 str(values) + " not suitable")
+            factors = self.scales
+        elif self.scale is not None:
+            factors = [self.scale] * len(values)
+        else:
+            factors = ()
+        scaled = list(values)
+        for i, x in enumerate(factors):
+            if x is not None:
+                val = float(scaled[i]) / x
+                if val % 1 == 0:
+                    val = int(val)
+                scaled[i] = val
+
+        encoded = [self.dest]
+
+        # when no datacode(s) specified, pass values on as numerical values
+        if self.datacodes is None and self.datacode == '0':
+            for val in scaled:
+                if float(val) % 1 != 0:
+                    encoded.append(float(val))
+                else:
+                    encoded.append(int(float(val)))
+            return encoded
+
+        if self.datacodes is not None:
+            if len(scaled) != len(self.datacodes):
+                raise ValueError("TX datacodes: " + str(list(self.datacodes)) +
+                                 " are not valid for values " + str(scaled))
+            frame = self.struct
+        else:
+            frame = get_struct('<' + str(len(scaled)) + self.datacode)
+
+        try:
+            encoded.extend(bytearray(frame.pack(*[int(val) for val in scaled])))
+        except struct.error as e:
+            raise ValueError("TX values " + str(scaled) + " can not be encoded: " + str(e))
+        return encoded
+
+
+"""EmonHubNode
+
+A listed node's settings, flattened & compiled. Immutable.
+
+nodeid (int): node id
+nodename (string): node name or None
+names (tuple): names of the node's rx values
+units (tuple): units of the node's rx values
+rx, tx (EmonHubNodePlan): compiled rx & tx settings (default_plan if none)
+
+"""
+
+EmonHubNode = collections.namedtuple('EmonHubNode', 'nodeid nodename names units rx tx')
+
+
+def _as_tuple(setting):
+    """Return a (comma separated) list setting as a tuple of strings."""
+
+    if isinstance(setting, (list, tuple)):
+        return tuple([str(v).strip() for v in setting])
+    return (str(setting).strip(),)
+
+
+class EmonHubNodeRegistry(object):
+    """The [nodes] settings, indexed by integer node id.
+
+    A registry is never modified once built. On a settings reload a new
+    registry is built and published with update_nodelist(), so readers
+    fetch ehc.registry once and see one consistent configuration.
+
+    """
+
+    def __init__(self, nodes=None):
+
+        self._nodes = {}
+        # Resolved tx plans, keyed by (dest, interfacer datacode, interfacer scale)
+        self._txplans = {}
+
+        if not nodes:
+            return
+
+        for key in nodes:
+            spec = nodes[key]
+            try:
+                nodeid = int(key)
+            except ValueError:
+                _log.warning("Node '" + str(key) + "' ignored: node id is not a number")
+                continue
+
+            plans = {'rx': default_plan, 'tx': default_plan}
+            for direction in plans:
+                if direction not in spec:
+                    continue
+                try:
+                    plans[direction] = EmonHubNodePlan(spec[direction])
+                except (ValueError, TypeError) as e:
+                    _log.warning("Node " + str(key) + " " + direction + " settings ignored: " + str(e))
+                    continue
+                for ignored in plans[direction].ignored:
+                    _log.warning("Node " + str(key) + " " + direction + " setting ignored, " + ignored)
+
+            rx = spec['rx'] if 'rx' in spec else {}
+            self._nodes[nodeid] = EmonHubNode(
+                nodeid=nodeid,
+                nodename=str(spec['nodename']) if 'nodename' in spec else None,
+                names=_as_tuple(rx['names']) if 'names' in rx else (),
+                units=_as_tuple(rx['units']) if 'units' in rx else (),
+                rx=plans['rx'],
+                tx=plans['tx'])
+
+    def __contains__(self, nodeid):
+        return nodeid in self._nodes
+
+    def __iter__(self):
+        return iter(self._nodes)
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def get(self, nodeid):
+        """Return the EmonHubNode for nodeid (int), or None if not listed."""
+
+        return self._nodes.get(nodeid)
+
+    def rx_plan(self, nodeid):
+        """Return the rx plan for nodeid (int), default_plan if none."""
+
+        node = self._nodes.get(nodeid)
+        if node is None:
+            return default_plan
+        return node.rx
+
+    def tx_plan(self, dest, datacode, scale):
+        """Return the (cached) tx plan for node 'dest' (int) and an interfacer's defaults."""
+
+        key = (dest, datacode, scale)
+        plan = self._txplans.get(key)
+        if plan is None:
+            node = self._nodes.get(dest)
+            plan = EmonHubTxPlan(str(dest), node.tx if node else default_plan, datacode, scale)
+            # Different defaults can resolve to the same encoding, share one plan for them
+            plan = self._txplans.setdefault(plan.key(), plan)
+            self._txplans[key] = plan
+        return plan
+
+
+# The current node registry, only ever replaced as a whole
+registry = EmonHubNodeRegistry()
+
+
+def update_nodelist(nodes):
+    """Build a registry from the [nodes] settings and publish it.
+
+    nodes (dict): the [nodes] section of the settings
+
+    """
+
+    global registry
+
+    # A single reference swap, readers see either the old or the new registry
+    registry = EmonHubNodeRegistry(nodes)
+
+
 def decode(datacode, frame):
     # Ensure little-endian & standard sizes used
     e = '<'
@@ -0,0 +1,409 @@
+"""
+
+  This code is released under the GNU Affero General Public License.
+
+  OpenEnergyMonitor project:
+  http://openenergymonitor.org
+
+"""
+
+import copy
+import mmap
+import time
+import signal
+import struct
+import logging
+import threading
+import traceback
+import multiprocessing
+
+import emonhub_coder as ehc
+import interfacers.emonhub_interfacer as ehi
+from interfacers.Cargo import new_cargo
+
+"""class EmonHubFrameRing
+
+A ring of received frames in memory shared by a child process (the only
+writer) and the hub (the only reader).
+
+Each slot holds one fixed layout record, so a frame is copied in and out
+with struct rather than pickled:
+
+    timestamp (d), nodeid (H), target (H), rssi (h), count (H),
+    intmask (Q), then MAX_VALUES values (d)
+
+Bit n of intmask is set when value n is an integer. Integers a double
+can't hold exactly (e.g. large 'q' and 'Q' values) don't fit a record.
+Two semaphores count the filled and the free slots, so neither side needs
+a lock.
+
+"""
+
+# Values a record can hold, larger frames are passed through the pipe
+MAX_VALUES = 64
+
+# Slots in a ring
+RING_SLOTS = 256
+
+# Largest integer a record value (a double) holds exactly
+MAX_EXACT = 2 ** 53
+
+RECORD = struct.Struct('<dHHhHQ' + str(MAX_VALUES) + 'd')
+
+
+class EmonHubFrameRing(object):
+
+    def __init__(self, slots=RING_SLOTS):
+
+        self.slots = slots
+
+        # Anonymous shared mapping, inherited by the child when it is forked
+        self._buf = mmap.mmap(-1, slots * RECORD.size)
+        self._filled = multiprocessing.Semaphore(0)
+        self._free = multiprocessing.Semaphore(slots)
+
+        # Each side only ever moves its own position
+        self._head = 0
+        self._tail = 0
+
+    @staticmethod
+    def fits(cargo):
+        """Return True if a cargo can be stored as a record."""
+
+        if len(cargo.realdata) > MAX_VALUES:
+            return False
+        for value in cargo.realdata:
+            if type(value) is float:
+                continue
+            if type(value) not in (int, long) or abs(value) > MAX_EXACT:
+                return False
+        return True
+
+    def put(self, cargo, timeout):
+        """Write a cargo to the ring, waiting up to timeout seconds for a free slot.
+
+        Return False if the ring stayed full.
+
+        """
+
+        if not self._free.acquire(True, timeout):
+            return False
+
+        values = [0.0] * MAX_VALUES
+        intmask = 0
+        for i, value in enumerate(cargo.realdata):
+            if not isinstance(value, float):
+                intmask |= 1 << i
+            values[i] = value
+        RECORD.pack_into(self._buf, self._head * RECORD.size, cargo.timestamp, cargo.nodeid,
+                         cargo.target, cargo.rssi, len(cargo.realdata), intmask, *values)
+        self._head = (self._head + 1) % self.slots
+
+        self._filled.release()
+        return True
+
+    def get(self, timeout):
+        """Read the next cargo from the ring, waiting up to timeout seconds.
+
+        Return None if the ring stayed empty.
+
+        """
+
+        if not self._filled.acquire(True, timeout):
+            return None
+
+        record = RECORD.unpack_from(self._buf, self._tail * RECORD.size)
+        self._tail = (self._tail + 1) % self.slots
+        self._free.release()
+
+        timestamp, nodeid, target, rssi, count, intmask = record[:6]
+        values = list(record[6:6 + count])
+        for i in range(count):
+            if intmask >> i & 1:
+                values[i] = int(values[i])
+        return new_cargo(realdata=values, nodeid=nodeid, timestamp=timestamp,
+                         target=target, rssi=rssi)
+
+
+"""class EmonHubProcessInterfacer
+
+Runs an interfacer in a child process and stands in for it in the hub.
+
+The child's decoded frames come back through an EmonHubFrameRing and are
+published to the pubchannels from this thread. Cargos from the subchannels,
+settings and [nodes] updates are sent to the child through a pipe. If the
+child dies it is restarted after RESTART_DELAY seconds, the rest of the
+hub carries on.
+
+Used when an interfacer's settings include "process = yes".
+
+"""
+
+# Seconds to wait before restarting a child process that died
+RESTART_DELAY = 10
+
+# Seconds to wait for a child process to stop before killing it
+STOP_TIMEOUT = 5
+
+
+class EmonHubProcessInterfacer(ehi.EmonHubInterfacer):
+
+    def __init__(self, name, interfacer_type, **kwargs):
+
+        # Initialization
+        super(EmonHubProcessInterfacer, self).__init__(name)
+
+        if not hasattr(ehi, interfacer_type):
+            raise ehi.EmonHubInterfacerInitError("Unknown interfacer type " + str(interfacer_type))
+
+        self._type = interfacer_type
+        self._init_kwargs = dict(kwargs)
+        self._runtimesettings = {}
+        self._nodes = None
+
+        self._process = None
+        self._conn = None
+        self._ring = None
+        self._restart_at = 0
+
+        # The pipe is written from the hub's thread (settings) and this one (cargos)
+        self._lock = threading.Lock()
+
+    def run(self):
+        """Start the child process and pass on its frames until stopped."""
+
+        while not self.stop:
+            if self._process is None or not self._process.is_alive():
+                self._restart()
+                continue
+
+            # Pass on the child's frames, waiting for one unless cargos are queued
+            rxc = self._ring.get(0 if len(self._inbox) else 0.1)
+            # Messages sent before the frames were written apply to them
+            self._recv()
+            burst = int(self._settings['burst'])
+            while rxc is not None:
+                self._publish(rxc)
+                burst -= 1
+                rxc = self._ring.get(0) if burst > 0 else None
+
+            self._drain_inbox()
+
+        self._inbox.close()
+        self._stop_child()
+
+    def _restart(self):
+        """(Re)start the child process, waiting RESTART_DELAY after a failure."""
+
+        if self._process is not None:
+            self._log.error(self.name + " process died, exit code " + str(self._process.exitcode))
+            # Pass on what it left behind
+            self._recv()
+            rxc = self._ring.get(0)
+            while rxc is not None:
+                self._publish(rxc)
+                rxc = self._ring.get(0)
+            self._conn.close()
+            self._process = None
+            self._restart_at = time.time() + RESTART_DELAY
+
+        if time.time() < self._restart_at:
+            time.sleep(0.1)
+            return
+
+        # Settings and [nodes] updates made meanwhile wait for the lock, then
+        # reach the new child through the pipe rather than being dropped
+        with self._lock:
+            self._ring = EmonHubFrameRing()
+            self._conn, conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_child_main, name=self.name,
+                                              args=(self._type, self.name, self._init_kwargs,
+                                                    self._runtimesettings, self._nodes,
+                                                    self._ring, conn))
+            process.daemon = True
+            process.start()
+            conn.close()
+            self._process = process
+        self._log.info(self.name + " running " + self._type + " in process " + str(self._process.pid))
+
+    def _stop_child(self):
+        """Ask the child process to stop, killing it if it doesn't."""
+
+        if self._process is None:
+            return
+        self._send(('stop',))
+        self._process.join(STOP_TIMEOUT)
+        if self._process.is_alive():
+            self._log.warning(self.name + " process did not stop, terminating it")
+            self._process.terminate()
+            self._process.join()
+        self._conn.close()
+        self._process = None
+
+    def _send(self, msg):
+        """Send a message to the child process."""
+
+        with self._lock:
+            if self._process is None:
+                return
+            try:
+                self._conn.send(msg)
+            except (IOError, OSError, ValueError) as e:
+                # The child has gone, it will be restarted
+                self._log.debug(self.name + " unable to reach process: " + str(e))
+
+    def _recv(self):
+        """Handle the messages sent by the child process."""
+
+        try:
+            while self._conn.poll():
+                msg = self._conn.recv()
+                if msg[0] == 'cargo':
+                    # A frame that didn't fit a ring record, or for other channels
+                    self._publish(*msg[1:])
+                elif msg[0] == 'channels':
+                    # Publish & subscribe as the child's interfacer would
+                    self._settings['pubchannels'] = msg[1]
+                    self._settings['subchannels'] = msg[2]
+                    self._subscribe()
+        except (EOFError, IOError, OSError):
+            pass
+
+    def receiver(self, cargo):
+        """Forward a cargo from the subscribed channels to the child process."""
+
+        txc = copy.copy(cargo)
+        # Encoded data is per process
+        txc.encoded = {}
+        txc.encodings = {}
+        self._send(('cargo', txc))
+
+    def update_nodes(self, nodes):
+        """Pass the [nodes] settings on to the child process's registry."""
+
+        self._nodes = nodes.dict() if hasattr(nodes, 'dict') else dict(nodes)
+        self._send(('nodes', self._nodes))
+
+    def set(self, **kwargs):
+        """Apply the queue settings here and pass all settings on to the child process."""
+
+        for key in ['burst', 'queuesize', 'overflow']:
+            if key in kwargs:
+                self._settings[key] = kwargs[key]
+        self._inbox.configure(*self._queue_settings())
+
+        self._runtimesettings = dict(kwargs)
+        self._send(('set', self._runtimesettings))
+
+
+"""class EmonHubProcessChild
+
+The child process side of an EmonHubProcessInterfacer.
+
+Runs the interfacer's thread, writing what it publishes to the ring and
+handling the messages from the hub.
+
+"""
+
+class EmonHubProcessChild(object):
+
+    def __init__(self, interfacer, ring, conn):
+
+        # Initialize logger
+        self._log = logging.getLogger("EmonHub")
+
+        self._interfacer = interfacer
+        self._ring = ring
+        self._conn = conn
+        self._lock = threading.Lock()
+
+        self._dropped = 0
+        self._reported = 0
+
+        # Publish to the hub rather than this process's channels
+        interfacer._publish = self.publish
+
+    def run(self, settings):
+        """Run the interfacer until the hub stops it or its thread dies."""
+
+        I = self._interfacer
+        self._update(settings)
+        I.start()
+
+        while I.isAlive():
+            try:
+                if not self._conn.poll(0.5):
+                    continue
+                msg = self._conn.recv()
+            except (EOFError, IOError, OSError):
+                # The hub has gone
+                break
+            if msg[0] == 'stop':
+                break
+            elif msg[0] == 'set':
+                self._update(msg[1])
+            elif msg[0] == 'nodes':
+                ehc.update_nodelist(msg[1])
+            elif msg[0] == 'cargo':
+                I._enqueue(msg[1])
+
+        I.stop = True
+        I.join()
+
+    def _update(self, settings):
+        """Apply the runtime settings and tell the hub the channels in use."""
+
+        I = self._interfacer
+        I.set(**settings)
+        self._send(('channels', I._settings['pubchannels'], I._settings['subchannels']))
+
+    def _send(self, msg):
+        """Send a message to the hub."""
+
+        with self._lock:
+            self._conn.send(msg)
+
+    def publish(self, rxc, channels=None):
+        """Pass a cargo published by the interfacer on to the hub."""
+
+        if not rxc or not rxc.realdata:
+            return
+        if channels is not None or not EmonHubFrameRing.fits(rxc):
+            rxc.encoded = {}
+            rxc.encodings = {}
+            self._send(('cargo', rxc) if channels is None else ('cargo', rxc, channels))
+        elif not self._ring.put(rxc, 0.5):
+            # The hub isn't keeping up, drop the frame rather than hold up the interface
+            self._dropped += 1
+            if time.time() - self._reported > 60:
+                self._reported = time.time()
+                self._log.warning(self._interfacer.name + " frame ring full, " +
+                                  str(self._dropped) + " frames dropped")
+
+
+def _child_main(interfacer_type, name, init_settings, settings, nodes, ring, conn):
+    """Create and run an interfacer in a child process."""
+
+    log = logging.getLogger("EmonHub")
+
+    # Other hub threads may have held the log handlers' locks when forked
+    for handler in log.handlers:
+        handler.createLock()
+
+    # Ctrl+C is handled by the hub, which then stops its children
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    if nodes is not None:
+        ehc.update_nodelist(nodes)
+
+    try:
+        interfacer = getattr(ehi, interfacer_type)(name, **init_settings)
+    except Exception as e:
+        log.error("Failed to create '" + name + "' interfacer: " + str(e))
+        return
+
+    try:
+        EmonHubProcessChild(interfacer, ring, conn).run(settings)
+    except Exception:
+        log.error(name + " process failed, Exception: " + traceback.format_exc())
+        interfacer.stop = True
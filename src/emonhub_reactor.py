@@ -0,0 +1,315 @@
+"""
+
+  This code is released under the GNU Affero General Public License.
+
+  OpenEnergyMonitor project:
+  http://openenergymonitor.org
+
+"""
+
+import os
+import time
+import heapq
+import errno
+import fcntl
+import Queue
+import select
+import logging
+import threading
+import traceback
+import collections
+
+"""class EmonHubReactor
+
+Runs interfacers from the hub's own thread rather than one thread each.
+
+Instead of every interfacer polling its input and sleeping, the reactor
+waits on the file descriptors of all its interfacers at once (epoll where
+available, select otherwise) and only calls an interfacer when data is
+ready. Regular work (each interfacer's action()) is run from a timer queue.
+
+Interfacers that can be run this way return the file descriptors to
+watch from _reactor_fds(), others keep running in their own thread.
+
+Calls that can't be made without blocking (HTTP posts, external commands)
+are handed to a small pool of worker threads with run_in_executor(), and
+their results passed back to the reactor's thread.
+
+"""
+
+# Seconds between two calls to an interfacer's action()
+ACTION_INTERVAL = 1.0
+
+# Number of worker threads for blocking calls
+WORKERS = 4
+
+
+class EmonHubReactor(object):
+
+    def __init__(self):
+
+        # Initialize logger
+        self._log = logging.getLogger("EmonHub")
+
+        self._interfacers = []
+
+        # Timer queue, a heap of [time due, sequence number, callback, args]
+        self._timers = []
+        self._seq = 0
+
+        # Registered file descriptors, fd: (read, write)
+        self._fds = {}
+        if hasattr(select, 'epoll'):
+            self._epoll = select.epoll()
+        else:
+            self._epoll = None
+
+        # Blocking calls waiting for a worker, and completed calls' callbacks
+        self._jobs = Queue.Queue()
+        self._done = collections.deque()
+        self._workers = []
+
+        # Pipe used by the workers to wake the reactor, non-blocking at both
+        # ends as the reactor's own thread may wake it, and None once closed
+        self._wake_r, self._wake_w = os.pipe()
+        for fd in (self._wake_r, self._wake_w):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self._wake_lock = threading.Lock()
+
+    def __contains__(self, interfacer):
+        return interfacer in self._interfacers
+
+    def add(self, interfacer):
+        """Run an interfacer from the reactor."""
+
+        self._log.debug("Reactor running " + interfacer.name)
+        interfacer._reactor = self
+        self._interfacers.append(interfacer)
+        self.call_later(0, self._action, interfacer)
+
+    def remove(self, interfacer):
+        """Stop running an interfacer from the reactor."""
+
+        if interfacer in self._interfacers:
+            self._log.debug("Reactor no longer running " + interfacer.name)
+            self._interfacers.remove(interfacer)
+            interfacer._reactor = None
+
+    def call_later(self, delay, callback, *args):
+        """Call callback(*args) in delay seconds.
+
+        Return a timer that can be passed to cancel()
+
+        """
+
+        self._seq += 1
+        timer = [time.time() + delay, self._seq, callback, args]
+        heapq.heappush(self._timers, timer)
+        return timer
+
+    def cancel(self, timer):
+        """Cancel a timer returned by call_later()."""
+
+        timer[2] = None
+
+    def wake(self):
+        """Wake the reactor from another thread, eg when a cargo is queued."""
+
+        with self._wake_lock:
+            if self._wake_w is None:
+                return
+            try:
+                os.write(self._wake_w, b'.')
+            except OSError as e:
+                # Full, the reactor will wake anyway
+                if e.errno != errno.EAGAIN:
+                    raise
+
+    def run_in_executor(self, func, callback=None, *args):
+        """Run the blocking func(*args) in a worker thread.
+
+        callback(result) is then called from the reactor's thread.
+
+        """
+
+        if not self._workers:
+            for i in range(WORKERS):
+                worker = threading.Thread(target=self._worker, name="Worker" + str(i + 1))
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+        self._jobs.put((func, args, callback))
+
+    def close(self):
+        """Stop running all interfacers."""
+
+        for I in list(self._interfacers):
+            self.remove(I)
+            if I.stop:
+                I._inbox.close()
+                I.close()
+        # Workers busy with a blocking call are daemons, don't wait long for them
+        for worker in self._workers:
+            self._jobs.put(None)
+        for worker in self._workers:
+            worker.join(1.0)
+        self._workers = []
+        if self._epoll is not None:
+            self._epoll.close()
+        self._fds = {}
+        with self._wake_lock:
+            os.close(self._wake_r)
+            os.close(self._wake_w)
+            self._wake_r = self._wake_w = None
+
+    def poll(self, timeout):
+        """Wait up to timeout seconds for input or a timer and process them."""
+
+        # Drop interfacers that have been stopped
+        for I in list(self._interfacers):
+            if I.stop:
+                self.remove(I)
+                I._inbox.close()
+                I.close()
+
+        # Collect the file descriptors to watch
+        handlers = {}
+        wanted = {self._wake_r: (True, False)}
+        pending = []
+        for I in self._interfacers:
+            rfds, wfds = I._reactor_fds()
+            for fd in rfds:
+                handlers[fd] = I
+                wanted[fd] = (True, wanted.get(fd, (False, False))[1])
+            for fd in wfds:
+                handlers[fd] = I
+                wanted[fd] = (wanted.get(fd, (False, False))[0], True)
+            # Data already buffered won't wake us, so don't wait for it
+            if I._rx_pending():
+                pending.append(I)
+
+        # Don't wait past the next timer
+        if pending or any([len(I._inbox) for I in self._interfacers]):
+            timeout = 0
+        elif self._timers:
+            timeout = max(0, min(timeout, self._timers[0][0] - time.time()))
+
+        for fd, rw in self._wait(wanted, timeout):
+            if fd == self._wake_r:
+                self._completed()
+                continue
+            I = handlers[fd]
+            if rw[0]:
+                self._call(I._on_readable, fd)
+                if I in pending:
+                    pending.remove(I)
+            if rw[1]:
+                self._call(I._on_writable, fd)
+
+        for I in pending:
+            self._call(I._on_readable, None)
+
+        # Pass on the cargos queued for each interfacer
+        for I in self._interfacers:
+            if len(I._inbox):
+                self._call(I._drain_inbox)
+
+        # Run the timers that are due
+        now = time.time()
+        while self._timers and self._timers[0][0] <= now:
+            timer = heapq.heappop(self._timers)
+            if timer[2] is not None:
+                self._call(timer[2], *timer[3])
+
+    def _wait(self, wanted, timeout):
+        """Wait for the wanted fds, return a list of (fd, (readable, writable))."""
+
+        try:
+            if self._epoll is None:
+                r, w, x = select.select([fd for fd in wanted if wanted[fd][0]],
+                                        [fd for fd in wanted if wanted[fd][1]], [], timeout)
+                return [(fd, (fd in r, fd in w)) for fd in set(r + w)]
+
+            self._register(wanted)
+            events = self._epoll.poll(timeout)
+        except (select.error, IOError, OSError) as e:
+            # Interrupted by a signal (eg SIGINT), return to the hub
+            if e.args[0] == errno.EINTR:
+                return []
+            raise
+        return [(fd, (bool(ev & (select.EPOLLIN | select.EPOLLERR | select.EPOLLHUP)),
+                      bool(ev & select.EPOLLOUT))) for fd, ev in events]
+
+    def _register(self, wanted):
+        """Bring the epoll registrations in line with the wanted fds."""
+
+        for fd in list(self._fds):
+            if fd not in wanted:
+                del self._fds[fd]
+                try:
+                    self._epoll.unregister(fd)
+                except (IOError, OSError):
+                    # already closed
+                    pass
+
+        for fd, rw in wanted.items():
+            if self._fds.get(fd) == rw:
+                continue
+            events = 0
+            if rw[0]:
+                events |= select.EPOLLIN
+            if rw[1]:
+                events |= select.EPOLLOUT
+            if fd in self._fds:
+                self._epoll.modify(fd, events)
+            else:
+                self._epoll.register(fd, events)
+            self._fds[fd] = rw
+
+    def _worker(self):
+        """Make the blocking calls queued by run_in_executor()."""
+
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            func, args, callback = job
+            try:
+                result = func(*args)
+            except Exception:
+                self._log.warning("Reactor worker call failed, Exception: " + traceback.format_exc())
+                continue
+            if callback is not None:
+                self._done.append((callback, result))
+                self.wake()
+
+    def _completed(self):
+        """Pass the results of completed blocking calls to their callbacks."""
+
+        while True:
+            try:
+                if len(os.read(self._wake_r, 4096)) < 4096:
+                    break
+            except OSError as e:
+                if e.errno != errno.EAGAIN:
+                    raise
+                break
+        while self._done:
+            callback, result = self._done.popleft()
+            self._call(callback, result)
+
+    def _action(self, interfacer):
+        """Action an interfacer's regular tasks and schedule the next time."""
+
+        if interfacer not in self._interfacers:
+            return
+        self._call(interfacer.action)
+        self.call_later(ACTION_INTERVAL, self._action, interfacer)
+
+    def _call(self, callback, *args):
+        """Call a handler, logging rather than propagating any exception."""
+
+        try:
+            callback(*args)
+        except Exception:
+            self._log.warning("Reactor handler failed, Exception: " + traceback.format_exc())
@@ -24,6 +24,8 @@ class EmonHubCargo(object):
         # self.scales = []
         self.rawdata = rawdata
         self.encoded = {}
+        # encoded data shared by all interfacers using the same tx plan
+        self.encodings = {}
         # self.realdatacodes = []
 
 def new_cargo(rawdata="", realdata=[], nodeid=0, timestamp=0.0, target=0, rssi=0.0):
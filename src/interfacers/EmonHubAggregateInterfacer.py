@@ -0,0 +1,247 @@
+"""class EmonHubAggregateInterfacer
+
+Aggregates each node's frames from the subchannels over fixed windows and
+passes on one frame per window to the pubchannels.
+
+Windows are 'window' seconds long, aligned to multiples of it (eg on the
+minute), and the frame passed on is timestamped with the window's start.
+A window is passed on when the node's first frame of a later window is
+received, or 'delay' seconds after its end if none comes. Frames received
+for a window already passed on are dropped.
+
+How each value is aggregated is set per node in the [nodes] rx settings,
+'aggregates' per value (in the order of 'names') or 'aggregate' for all of
+the node's values, one of:
+
+    mean    the average of the values (default)
+    min     the smallest value
+    max     the largest value
+    last    the last value
+    energy  the value (eg power in W) integrated over the window, per hour
+            (eg energy in Wh). Each value is taken to hold until the next,
+            gaps longer than a window are not integrated.
+
+Nodes with neither use the interfacer's 'aggregate'.
+
+"""
+import time
+import Cargo
+import emonhub_coder as ehc
+from emonhub_interfacer import EmonHubInterfacer
+
+class EmonHubAggregateInterfacer(EmonHubInterfacer):
+
+    def __init__(self, name):
+        # Initialization
+        super(EmonHubAggregateInterfacer, self).__init__(name)
+
+        self._name = name
+
+        self._settings = {
+            'subchannels':['ch1'],
+            'pubchannels':['ch2'],
+            'queuesize': 1000,
+            'overflow': 'dropoldest',
+
+            'window': 60,
+            'delay': 5,
+            'aggregate': 'mean'
+        }
+
+        # Window, delay & default aggregate, set from the settings by set()
+        self._window = 60.0
+        self._delay = 5.0
+        self._aggregate = 'mean'
+
+        # The window being aggregated for each node, nodeid: EmonHubWindow
+        self._windows = {}
+        # The last frame received from each node, nodeid: (timestamp, values)
+        self._last = {}
+        # The end of the last window passed on for each node, nodeid: timestamp
+        self._ended = {}
+
+        # Counters
+        self.received = 0
+        self.passed = 0
+        self.late = 0
+        self.invalid = 0
+
+    def _reactor_fds(self):
+        """Nothing to watch, only cargos from the subchannels are handled."""
+
+        return [], []
+
+    def receiver(self, cargo):
+
+        nodeid = cargo.nodeid
+        t = cargo.timestamp
+        values = cargo.realdata
+        start = t - t % self._window
+        self.received += 1
+
+        # Checked before the window is touched, a value that can't be added
+        # would leave it half updated
+        for value in values:
+            if not isinstance(value, (int, long, float)):
+                self.invalid += 1
+                self._log.warning(str(cargo.uri) + " non-numeric value, dropped : " + str(values))
+                return
+
+        window = self._windows.get(nodeid)
+        if window is not None and t < window.start or t < self._ended.get(nodeid, 0):
+            self.late += 1
+            self._log.debug(str(cargo.uri) + " too late for its window, dropped : " + str(values))
+            return
+
+        if window is not None and (start >= window.end or len(values) != len(window.methods)):
+            self._close(nodeid)
+            window = None
+        if window is None:
+            window = EmonHubWindow(start, self._window, self._methods(cargo))
+            self._windows[nodeid] = window
+            if nodeid in self._last and len(self._last[nodeid][1]) != len(values):
+                del self._last[nodeid]
+
+        self._integrate(nodeid, t)
+        window.add(values)
+        self._last[nodeid] = (t, list(values))
+
+    def action(self):
+        """Pass on the windows that have ended 'delay' seconds ago."""
+
+        now = time.time()
+        for nodeid, window in self._windows.items():
+            if now >= window.end + self._delay:
+                self._close(nodeid)
+
+    def _methods(self, cargo):
+        """Return the aggregate for each of a cargo's values."""
+
+        plan = ehc.registry.rx_plan(cargo.nodeid)
+        count = len(cargo.realdata)
+        if plan.aggregates is not None:
+            if len(plan.aggregates) == count:
+                return plan.aggregates
+            self._log.warning(str(cargo.uri) + " Aggregates for node " + str(cargo.nodeid) +
+                              " not suitable for " + str(count) + " values, using '" +
+                              self._aggregate + "'")
+        elif plan.aggregate is not None:
+            return (plan.aggregate,) * count
+        return (self._aggregate,) * count
+
+    def _integrate(self, nodeid, until):
+        """Integrate the node's last values up to time until into its window."""
+
+        window = self._windows.get(nodeid)
+        last = self._last.get(nodeid)
+        if window is None or last is None:
+            return
+        t, values = last
+        if until - t > self._window:
+            # A gap, the node wasn't heard from
+            return
+        dt = min(until, window.end) - max(t, window.start)
+        if dt > 0:
+            window.integrate(values, dt)
+
+    def _close(self, nodeid):
+        """Pass on a node's window."""
+
+        self._integrate(nodeid, self._windows[nodeid].end)
+        window = self._windows.pop(nodeid)
+        self._ended[nodeid] = window.end
+        rxc = Cargo.new_cargo(realdata=window.values(), nodeid=nodeid, timestamp=window.start)
+        self._log.debug(str(rxc.uri) + " node " + str(nodeid) + " aggregated " + str(window.count) +
+                        " frames : " + str(rxc.realdata))
+        self.passed += 1
+        self._publish(rxc)
+
+    def stats(self):
+        """Return the number of frames received, passed on and dropped as late or invalid as a dict."""
+
+        return {'received': self.received, 'passed': self.passed, 'late': self.late,
+                'invalid': self.invalid}
+
+    def set(self, **kwargs):
+        for key,setting in self._settings.iteritems():
+            if key in kwargs.keys():
+                # replace default
+                self._settings[key] = kwargs[key]
+
+        for key in ['window', 'delay']:
+            try:
+                value = float(self._settings[key])
+                if value <= 0 and key == 'window':
+                    raise ValueError
+                setattr(self, '_' + key, value)
+            except ValueError:
+                self._log.warning("'%s' is not valid for %s: %s" % (self._settings[key], self.name, key))
+        try:
+            self._aggregate = ehc.aggregate(self._settings['aggregate'])
+        except ValueError:
+            self._log.warning("'%s' is not valid for %s: aggregate" % (self._settings['aggregate'], self.name))
+
+        # Subscribe to internal channels
+        self._subscribe()
+
+
+"""class EmonHubWindow
+
+The values of one node's frames over a window, aggregated as they come.
+
+"""
+
+class EmonHubWindow(object):
+
+    def __init__(self, start, length, methods):
+
+        self.start = start
+        self.end = start + length
+        self.methods = methods
+        self.count = 0
+
+        n = len(methods)
+        self._sums = [0] * n
+        self._mins = [None] * n
+        self._maxs = [None] * n
+        self._lasts = [None] * n
+        # Value seconds, for 'energy'
+        self._energy = [0.0] * n
+
+    def add(self, values):
+        """Add a frame's values."""
+
+        self.count += 1
+        for i, value in enumerate(values):
+            self._sums[i] += value
+            if self._mins[i] is None or value < self._mins[i]:
+                self._mins[i] = value
+            if self._maxs[i] is None or value > self._maxs[i]:
+                self._maxs[i] = value
+            self._lasts[i] = value
+
+    def integrate(self, values, dt):
+        """Add values held for dt seconds to the energy."""
+
+        for i, value in enumerate(values):
+            self._energy[i] += value * dt
+
+    def values(self):
+        """Return the aggregated values, whole numbers as ints."""
+
+        values = []
+        for i, method in enumerate(self.methods):
+            if method == 'min':
+                value = self._mins[i]
+            elif method == 'max':
+                value = self._maxs[i]
+            elif method == 'last':
+                value = self._lasts[i]
+            elif method == 'energy':
+                value = self._energy[i] / 3600
+            else:
+                value = float(self._sums[i]) / self.count
+            if value % 1 == 0:
+                value = int(value)
+            values.append(value)
+        return values
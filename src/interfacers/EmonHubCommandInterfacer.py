@@ -17,6 +17,8 @@ class EmonHubCommandInterfacer(EmonHubInterfacer):
         self._settings = {
             'subchannels': ['ch1'],
             'pubchannels': ['ch2'],
+            'queuesize': 1000,
+            'overflow': 'dropoldest',
             'execute_every_secs': 30,
             'timeout': 8,
             'withshell': 'y',
@@ -24,41 +26,63 @@ class EmonHubCommandInterfacer(EmonHubInterfacer):
             'command_regexes': ['Total Power\s*=\s([0-9\.,]+)'],
             'node': 31,
         };
+
+        self._last = time.time()
         
 
     def run(self):
-        last = time.time()
-        # XXX Can we make this event driven instead?
         while not self.stop:
-            # Read the input and process data if available
-            
-            now = time.time()
-            if (now-last) > int(self._settings['execute_every_secs']):
-                last = now
-                s = self._settings
-                
-                withshell = s['withshell'].lower() in ['1', 'yes', 'y', 'true']
-                self._log.debug(str(s['execute_every_secs']) +"s loop")
-                rxc = Cargo.new_cargo()
-                rxc.nodeid = int(s['node'])
-                import subprocess32
-                try: 
-                    # TODO, make timeout dynamic?  e.g. Accept double the average execution time, or loop time, which ever the least?
-                    rxc.realdata = self.parser(subprocess32.check_output(s['command'], shell=withshell, timeout=float(s['timeout'])))
-                    if rxc.realdata:
-                        for channel in s["pubchannels"]:
-                            dispatcher.send(channel, cargo=rxc)
-                            self._log.debug(str(rxc.uri) + " Sent to channel' : " + str(channel))
-                # TODO record any partial output via e.output?
-                except (subprocess32.TimeoutExpired, subprocess32.CalledProcessError) as e:
-                    self._log.warn(str(e))
-                except (OSError) as e:
-                    self._log.warn(str(e))
-                      
+            self.action()
+            # Pass on the cargos from the subscribed channels
+            self._drain_inbox()
             # Don't loop too fast
-            time.sleep(0.1)
-            # Action reporter tasks
-            # self.action()
+            self._inbox.wait(0.1)
+        self._inbox.close()
+
+    def _reactor_fds(self):
+        """Nothing to watch, commands are executed by the reactor's workers."""
+
+        return [], []
+
+    def action(self):
+        """Execute the command every 'execute_every_secs'."""
+
+        now = time.time()
+        if (now-self._last) > int(self._settings['execute_every_secs']):
+            self._last = now
+            self._run_blocking(self._execute, self._publish)
+
+    def _execute(self):
+        """Execute the command and parse its output.
+
+        Return a cargo of the parsed data, or None
+
+        """
+
+        s = self._settings
+        
+        withshell = s['withshell'].lower() in ['1', 'yes', 'y', 'true']
+        self._log.debug(str(s['execute_every_secs']) +"s loop")
+        rxc = Cargo.new_cargo()
+        rxc.nodeid = int(s['node'])
+        import subprocess32
+        try: 
+            # TODO, make timeout dynamic?  e.g. Accept double the average execution time, or loop time, which ever the least?
+            rxc.realdata = self.parser(subprocess32.check_output(s['command'], shell=withshell, timeout=float(s['timeout'])))
+        # TODO record any partial output via e.output?
+        except (subprocess32.TimeoutExpired, subprocess32.CalledProcessError) as e:
+            self._log.warn(str(e))
+            return
+        except (OSError) as e:
+            self._log.warn(str(e))
+            return
+        return rxc
+
+    def _publish(self, rxc):
+        """Pass the parsed data on to the publish channels."""
+
+        if rxc and rxc.realdata:
+            super(EmonHubCommandInterfacer, self)._publish(rxc)
 
 
     def parser(self, cmdoutput):
@@ -92,7 +116,5 @@ class EmonHubCommandInterfacer(EmonHubInterfacer):
                 # replace default
                 self._settings[key] = kwargs[key]
         
-        # Subscribe to internal channels   
-        for channel in self._settings["subchannels"]:
-            dispatcher.connect(self.receiver, channel)
-            self._log.debug(self._name+" Subscribed to channel' : " + str(channel))
+        # Subscribe to internal channels
+        self._subscribe()
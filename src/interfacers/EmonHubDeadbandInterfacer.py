@@ -0,0 +1,116 @@
+"""class EmonHubDeadbandInterfacer
+
+Passes on frames from the subchannels to the pubchannels only when they
+have changed (report by exception).
+
+A frame is passed on if any of its values has moved outside its deadband
+of the value last passed on, or 'heartbeat' seconds have passed since the
+node's last frame was. Otherwise the whole frame is dropped: values are
+posted by position, so single values can't be left out.
+
+Deadbands are set per node in the [nodes] rx settings, 'deadbands' per
+value (in the order of 'names') or 'deadband' for all of the node's
+values, eg "0.5" (absolute) or "2%" (relative). Nodes with neither use
+the interfacer's 'deadband'.
+
+"""
+import time
+import emonhub_coder as ehc
+from emonhub_interfacer import EmonHubInterfacer
+
+class EmonHubDeadbandInterfacer(EmonHubInterfacer):
+
+    def __init__(self, name):
+        # Initialization
+        super(EmonHubDeadbandInterfacer, self).__init__(name)
+
+        self._name = name
+
+        self._settings = {
+            'subchannels':['ch1'],
+            'pubchannels':['ch2'],
+            'queuesize': 1000,
+            'overflow': 'dropoldest',
+
+            'deadband': '0',
+            'heartbeat': 300
+        }
+
+        # Default deadband & heartbeat, set from the settings by set()
+        self._deadband = (0.0, False)
+        self._heartbeat = 300.0
+
+        # The last frame passed on for each node, nodeid: (timestamp, values)
+        self._last = {}
+
+        # Counters
+        self.passed = 0
+        self.dropped = 0
+
+    def _reactor_fds(self):
+        """Nothing to watch, only cargos from the subchannels are handled."""
+
+        return [], []
+
+    def receiver(self, cargo):
+
+        if self._changed(cargo):
+            self._last[cargo.nodeid] = (cargo.timestamp, list(cargo.realdata))
+            self.passed += 1
+            self._publish(cargo)
+        else:
+            self.dropped += 1
+            self._log.debug(str(cargo.uri) + " within deadband, dropped : " + str(cargo.realdata))
+
+    def _changed(self, cargo):
+        """Return True if a cargo is to be passed on."""
+
+        last = self._last.get(cargo.nodeid)
+        if last is None:
+            return True
+        timestamp, previous = last
+        values = cargo.realdata
+        if len(values) != len(previous) or cargo.timestamp - timestamp >= self._heartbeat:
+            return True
+
+        plan = ehc.registry.rx_plan(cargo.nodeid)
+        if plan.deadbands is not None:
+            if len(plan.deadbands) != len(values):
+                self._log.warning(str(cargo.uri) + " Deadbands for node " + str(cargo.nodeid) +
+                                  " not suitable for " + str(len(values)) + " values, passed on")
+                return True
+            bands = plan.deadbands
+        elif plan.deadband is not None:
+            bands = [plan.deadband] * len(values)
+        else:
+            bands = [self._deadband] * len(values)
+
+        for value, before, (band, relative) in zip(values, previous, bands):
+            if relative:
+                band *= abs(before)
+            if abs(value - before) > band:
+                return True
+        return False
+
+    def stats(self):
+        """Return the number of frames passed on and dropped as a dict."""
+
+        return {'passed': self.passed, 'dropped': self.dropped}
+
+    def set(self, **kwargs):
+        for key,setting in self._settings.iteritems():
+            if key in kwargs.keys():
+                # replace default
+                self._settings[key] = kwargs[key]
+
+        try:
+            self._deadband = ehc.deadband(self._settings['deadband'])
+        except ValueError:
+            self._log.warning("'%s' is not valid for %s: deadband" % (self._settings['deadband'], self.name))
+        try:
+            self._heartbeat = float(self._settings['heartbeat'])
+        except ValueError:
+            self._log.warning("'%s' is not valid for %s: heartbeat" % (self._settings['heartbeat'], self.name))
+
+        # Subscribe to internal channels
+        self._subscribe()
@@ -1,11 +1,30 @@
 """class EmonHubEmoncmsHTTPInterfacer
 """
+import os
 import time
 import json
-import urllib2
+import zlib
+import hashlib
+import logging
+import socket
 import httplib
+import threading
 from pydispatch import dispatcher
 from emonhub_interfacer import EmonHubInterfacer
+from emonhub_http import EmonHubHTTPPool, EmonHubRateLimiter
+from emonhub_buffer import EmonHubMemoryBuffer, EmonHubDiskBuffer
+
+# Posts taking longer than this (seconds) shrink the batch size
+TARGET_RTT = 5.0
+
+# Smallest batch size, in frames
+MIN_BATCH = 10
+
+# Seconds between two reports of the progress catching up on a backlog
+REPORT_INTERVAL = 60
+
+# Seconds to wait on stopping for posts in progress to finish
+SHUTDOWN_TIMEOUT = 5
 
 class EmonHubEmoncmsHTTPInterfacer(EmonHubInterfacer):
 
@@ -18,18 +37,61 @@ class EmonHubEmoncmsHTTPInterfacer(EmonHubInterfacer):
         self._settings = {
             'subchannels':['ch1'],
             'pubchannels':['ch2'],
+            'queuesize': 1000,
+            'overflow': 'dropoldest',
             
             'apikey': "",
             'url': "http://emoncms.org",
             'senddata': 1,
-            'sendstatus': 0
+            'sendstatus': 0,
+            'connect_timeout': 10,
+            'read_timeout': 60,
+            'buffer': 'memory',
+            'bufferdir': '/var/lib/emonhub',
+            'buffersize': 10,
+            'maxframes': 500,
+            'maxbytes': 100000,
+            'maxage': 30,
+            'compress': 'none',
+            'workers': 2,
+            'maxrps': 0,
+            'maxbps': 0
         }
         
-        self.buffer = []
-        self.lastsent = time.time() 
-        self.lastsentstatus = time.time()
+        # Persistent connections to the server
+        self._pool = EmonHubHTTPPool()
+
+        # Frames waiting to be sent, opened by set(), and the (kind, path,
+        # maxbytes) of a buffer for the sender to switch to
+        self.buffer = None
+        self._buffer_settings = None
+        self._reopen = None
+
+        # Frames received since the sender last took them, swapped for an
+        # empty list by the sender so receiving never waits on the disk or network
+        self._ingest = []
+        self._ingest_bytes = 0
+        self._ingest_lock = threading.Lock()
+
+        # Sender thread, started by action()
+        self._sender = None
+        self._wakeup = threading.Event()
+
+        # Flush policy, set from the settings by set()
+        self._maxframes = 500
+        self._maxbytes = 100000
+        self._maxage = 30.0
+        self._workers = 2
+        self._maxrps = 0
+        self._maxbps = 0
+
+        # The servers posted to, each an EmonHubEmoncmsTarget
+        self._targets = []
 
     def receiver(self, cargo):
+
+        if not int(self._settings['senddata']):
+            return
     
         # Create a frame of data in "emonCMS format"
         f = []
@@ -42,67 +104,164 @@ class EmonHubEmoncmsHTTPInterfacer(EmonHubInterfacer):
 
         self._log.debug(str(cargo.uri) + " adding frame to buffer => "+ str(f))
         
-        # Append to bulk post buffer
-        self.buffer.append(f)
+        # Append to the ingest list, waking the sender once enough is waiting
+        frame = json.dumps(f, separators=(',', ':'))
+        with self._ingest_lock:
+            self._ingest.append(frame)
+            self._ingest_bytes += len(frame) + 1
+            full = len(self._ingest) >= self._maxframes or self._ingest_bytes >= self._maxbytes
+        if full:
+            self._wakeup.set()
         
     def action(self):
-    
-        now = time.time()
-        
-        if (now-self.lastsent)>30:
-            self.lastsent = now
-            # print json.dumps(self.buffer)
-            if int(self._settings['senddata']):
-                self.bulkpost(self.buffer)
-            self.buffer = []
-            
-        if (now-self.lastsentstatus)>60:
-            self.lastsentstatus = now
-            if int(self._settings['sendstatus']):
-                self.sendstatus()
-            
-    def bulkpost(self,databuffer):
-    
-        if not 'apikey' in self._settings.keys() or str.__len__(str(self._settings['apikey'])) != 32 \
-                or str.lower(str(self._settings['apikey'])) == 'xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx':
+
+        # Start the sender the first time round
+        if self._sender is None:
+            self._sender = threading.Thread(target=self._send_loop, name=self.name + "-sender")
+            self._sender.daemon = True
+            self._sender.start()
+
+    def _reactor_fds(self):
+        """Nothing to watch, posts are made by the sender thread."""
+
+        return [], []
+
+    def close(self):
+        """Wait for the sender to store the frames left in the buffer and close it."""
+
+        if self._sender is None:
+            # Never started, nothing is posting
+            if self.buffer is None:
+                return
+            self._swap()
+            self.buffer.close()
+        else:
+            self._wakeup.set()
+            self._sender.join(SHUTDOWN_TIMEOUT * 2)
+            if self._sender.isAlive():
+                self._log.warning(self.name + " sender still busy, frames not yet buffered may be lost")
+        self._pool.close()
+
+    def _send_loop(self):
+        """Move the received frames to the buffer for the targets until stopped."""
+
+        while not self.stop:
+            self._wakeup.wait(1.0)
+            self._wakeup.clear()
+            try:
+                self._switch_buffer()
+                self._send()
+            except Exception:
+                import traceback
+                self._log.warning(self.name + " sender failed, Exception: " + traceback.format_exc())
+                time.sleep(1)
+
+        # Let the posts in progress finish, but not for long
+        deadline = time.time() + SHUTDOWN_TIMEOUT
+        for target in self._targets:
+            target.stop = True
+            target.wake()
+        for target in self._targets:
+            if target.ident is not None:
+                target.join(max(0, deadline - time.time()))
+
+        # Keep what is left, and how far each target has got, for next time
+        self._swap()
+        self._ack()
+        self.buffer.close()
+
+    def _send(self):
+        """Store the frames received and let the targets post them."""
+
+        for target in self._targets:
+            if target.ident is None:
+                target.start()
+
+        if self._swap():
+            for target in self._targets:
+                target.wake()
+
+        self._ack()
+        self.buffer.sync()
+
+    def _swap(self):
+        """Take the ingest list, leaving an empty one, and store its frames in the buffer.
+
+        Return the number of frames stored.
+
+        """
+
+        with self._ingest_lock:
+            frames = self._ingest
+            self._ingest = []
+            self._ingest_bytes = 0
+        if frames:
+            last = self.buffer.put(frames)
+            # The targets post the newest frames ahead of any backlog
+            live = zip(range(last - len(frames) + 1, last + 1), frames)
+            for target in self._targets:
+                target.add_live(live)
+        return len(frames)
+
+    def _ack(self):
+        """Save each target's position and acknowledge the frames accepted by every target."""
+
+        buf = self.buffer
+        # Positions in a buffer that has since been switched don't apply
+        positions = dict([(target.key, target.acked) for target in self._targets
+                          if target.buffer is buf])
+        if positions:
+            buf.save_positions(positions)
+            buf.ack_through(min(positions.values()))
+
+    def _switch_buffer(self):
+        """Switch to the buffer set by set(), once no target is posting from the old one."""
+
+        reopen = self._reopen
+        if reopen is None:
             return
-            
-        data_string = json.dumps(databuffer, separators=(',', ':'))
-        
-        # Prepare URL string of the form
-        # http://domain.tld/emoncms/input/bulk.json?apikey=12345
-        # &data=[[0,10,82,23],[5,10,82,23],[10,10,82,23]]
-        # &sentat=15' (requires emoncms >= 8.0)
+        self._reopen = None
+        kind, path, maxbytes = reopen
 
-        # time that the request was sent at
-        sentat = int(time.time())
+        targets = list(self._targets)
+        for target in targets:
+            target.busy.acquire()
+        try:
+            # Keep what is left, and how far each target has got, with the old buffer
+            self._swap()
+            self._ack()
+            self.buffer.close()
 
-        # Construct post_url (without apikey)
-        post_url = self._settings['url']+'/input/bulk'+'.json?apikey='
-        post_body = "data="+data_string+"&sentat="+str(sentat)
+            self.buffer = self._new_buffer(kind, path, maxbytes)
+            self._buffer_settings = (kind, path)
+            # Start from the positions saved with the new buffer, if any,
+            # leaving out those of targets no longer posted to
+            for target in targets:
+                target.reset()
+            self._ack()
+        finally:
+            for target in targets:
+                target.busy.release()
 
-        # logged before apikey added for security
-        self._log.info("sending: " + post_url + "E-M-O-N-C-M-S-A-P-I-K-E-Y&" + post_body)
+    def stats(self):
+        """Return the stats of each target (see EmonHubEmoncmsTarget.stats) by url."""
 
-        # Add apikey to post_url
-        post_url = post_url + self._settings['apikey']
+        return dict([(target.url, target.stats()) for target in self._targets])
 
-        # The Develop branch of emoncms allows for the sending of the apikey in the post
-        # body, this should be moved from the url to the body as soon as this is widely
-        # adopted
+    def _gzip(self, pieces):
+        """Return a list of body pieces gzip compressed, a piece at a time."""
 
-        reply = self._send_post(post_url, post_body)
-        if reply == 'ok':
-            self._log.debug("acknowledged receipt with '" + reply + "' from " + self._settings['url'])
-            return True
-        else:
-            self._log.warning("send failure: wanted 'ok' but got '" +reply+ "'")
-            
-    def _send_post(self, post_url, post_body=None):
+        z = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        compressed = [z.compress(piece) for piece in pieces]
+        compressed.append(z.flush())
+        return [piece for piece in compressed if piece]
+
+    def _send_post(self, post_url, post_body=None, headers=None):
         """
 
         :param post_url:
-        :param post_body:
+        :param post_body: a string, or a list of strings sent one after the other
+        :param headers:
         :return: the received reply if request is successful
         """
         """Send data to server.
@@ -115,15 +274,11 @@ class EmonHubEmoncmsHTTPInterfacer(EmonHubInterfacer):
         """
 
         reply = ""
-        request = urllib2.Request(post_url, post_body)
         try:
-            response = urllib2.urlopen(request, timeout=60)
-        except urllib2.HTTPError as e:
-            self._log.warning(self.name + " couldn't send to server, HTTPError: " +
-                              str(e.code))
-        except urllib2.URLError as e:
-            self._log.warning(self.name + " couldn't send to server, URLError: " +
-                              str(e.reason))
+            status, response = self._pool.request(post_url, post_body, headers)
+        except socket.error as e:
+            self._log.warning(self.name + " couldn't send to server, socket error: " +
+                              str(e))
         except httplib.HTTPException:
             self._log.warning(self.name + " couldn't send to server, HTTPException")
         except Exception:
@@ -131,28 +286,493 @@ class EmonHubEmoncmsHTTPInterfacer(EmonHubInterfacer):
             self._log.warning(self.name + " couldn't send to server, Exception: " +
                               traceback.format_exc())
         else:
-            reply = response.read()
+            if status // 100 == 2:
+                reply = response
+            else:
+                self._log.warning(self.name + " couldn't send to server, HTTPError: " +
+                                  str(status))
         finally:
             return reply
             
-    def sendstatus(self):
-        # MYIP url
-        post_url = self._settings['url']+'/myip/set.json?apikey='
-        # Print info log
-        self._log.info("sending: " + post_url + "E-M-O-N-C-M-S-A-P-I-K-E-Y")
-        # add apikey
-        post_url = post_url + self._settings['apikey']
-        # send request
-        reply = self._send_post(post_url,None)
-            
     def set(self, **kwargs):
         for key,setting in self._settings.iteritems():
             if key in kwargs.keys():
                 # replace default
                 self._settings[key] = kwargs[key]
+
+        self._pool.connect_timeout = self._number('connect_timeout', self._pool.connect_timeout)
+        self._pool.read_timeout = self._number('read_timeout', self._pool.read_timeout)
+        self._maxframes = max(1, int(self._number('maxframes', self._maxframes)))
+        self._maxbytes = int(self._number('maxbytes', self._maxbytes))
+        self._maxage = self._number('maxage', self._maxage)
+        self._workers = max(1, int(self._number('workers', self._workers)))
+        self._maxrps = self._number('maxrps', self._maxrps)
+        self._maxbps = self._number('maxbps', self._maxbps)
+
+        self._open_buffer()
+        self._update_targets()
         
         # Subscribe to internal channels
-        for channel in self._settings["subchannels"]:
-            dispatcher.connect(self.receiver, channel)
-            self._log.debug(self._name+" Subscribed to channel' : " + str(channel))
+        self._subscribe()
+
+
+
+    def _number(self, key, current):
+        """Return setting key as a number, or current if it isn't valid."""
+
+        try:
+            return float(self._settings[key])
+        except ValueError:
+            self._log.warning("'%s' is not valid for %s: %s" % (self._settings[key], self.name, key))
+            return current
+
+    def _open_buffer(self):
+        """Open the buffer, or reopen it if its settings have changed."""
+
+        s = self._settings
+        try:
+            maxbytes = int(float(s['buffersize']) * 1024 * 1024)
+        except ValueError:
+            self._log.warning("'%s' is not valid for %s: buffersize" % (s['buffersize'], self.name))
+            maxbytes = 10 * 1024 * 1024
+        kind = str(s['buffer']).lower()
+        path = os.path.join(str(s['bufferdir']), self.name)
+
+        if kind not in ('disk', 'memory'):
+            self._log.warning("'%s' is not valid for %s: buffer" % (s['buffer'], self.name))
+            kind = 'memory'
+
+        if self._buffer_settings == (kind, path):
+            self.buffer.maxbytes = maxbytes
+            self._reopen = None
+        elif self.buffer is None:
+            # Nothing is using a buffer yet
+            self.buffer = self._new_buffer(kind, path, maxbytes)
+            self._buffer_settings = (kind, path)
+        else:
+            # The sender and the targets are using the buffer, the sender
+            # switches over once the posts in progress are done
+            self._reopen = (kind, path, maxbytes)
+            self._wakeup.set()
+
+    def _new_buffer(self, kind, path, maxbytes):
+        """Return a new buffer, in memory if a disk buffer can't be opened."""
+
+        if kind == 'disk':
+            try:
+                return EmonHubDiskBuffer(path, maxbytes)
+            except (IOError, OSError) as e:
+                self._log.error(self.name + " unable to open buffer in " + path +
+                                ", buffering in memory: " + str(e))
+        return EmonHubMemoryBuffer(maxbytes)
+
+    def _update_targets(self):
+        """Pair up the url and apikey settings, one target for each url."""
+
+        urls = self._settings['url']
+        apikeys = self._settings['apikey']
+        if not isinstance(urls, list):
+            urls = [urls]
+        if not isinstance(apikeys, list):
+            apikeys = [apikeys]
+        if len(apikeys) == 1:
+            # One apikey for all
+            apikeys = apikeys * len(urls)
+        elif len(apikeys) != len(urls):
+            self._log.warning(self.name + " has " + str(len(urls)) + " urls but " +
+                              str(len(apikeys)) + " apikeys")
+        pairs = [(str(url).strip(), str(apikey).strip()) for url, apikey in zip(urls, apikeys)]
+
+        current = dict([((t.url, t.apikey), t) for t in self._targets])
+        targets = []
+        for url, apikey in pairs:
+            target = current.pop((url, apikey), None)
+            if target is None:
+                target = EmonHubEmoncmsTarget(self, url, apikey, len(targets) + 1)
+            targets.append(target)
+        for target in current.itervalues():
+            target.stop = True
+        self._targets = targets
+
+        # Enough idle connections for every target's workers
+        self._pool.size = self._workers * len(targets) + 1
+
+
+"""class EmonHubEmoncmsTarget
+
+One of the servers an EmonHubEmoncmsHTTPInterfacer posts to.
+
+The frames are serialized once, in the interfacer's buffer, and shared by
+all its targets. Each target posts them from a thread of its own, keeping
+its own record of the frames accepted, its own batch size and retries, so
+a slow or failing server doesn't hold back the others. The interfacer's
+buffer only discards frames once every target has had them accepted.
+
+Each target's position is saved with the buffer, so after a restart it
+carries on from the last frame it had accepted (give or take the frames
+accepted since the buffer's last sync) rather than from the slowest
+target's.
+
+"""
+
+class EmonHubEmoncmsTarget(threading.Thread):
+
+    def __init__(self, interfacer, url, apikey, number):
+
+        threading.Thread.__init__(self)
+        self.setName(interfacer.name + "-target" + str(number))
+        self.daemon = True
+
+        # Initialize logger
+        self._log = logging.getLogger("EmonHub")
 
+        self._interfacer = interfacer
+        self.url = url
+        self.apikey = apikey
+        # Names the target's position saved in the buffer, without giving away the apikey
+        self.key = url + " " + hashlib.sha1(apikey).hexdigest()[:8]
+        self.stop = False
+        self._wakeup = threading.Event()
+
+        # Held while posting, so the interfacer can switch buffers in between
+        self.busy = threading.Lock()
+
+        # Frames per post, adapted to the server's response
+        self._batch = interfacer._maxframes
+        self._retry_at = 0
+        self._rps = EmonHubRateLimiter()
+        self._bps = EmonHubRateLimiter()
+
+        # The last frame accepted with none missing before it, the newest
+        # frames, posted ahead of any backlog, the ranges of frames accepted
+        # beyond acked, and the last frame handed out to be posted
+        self.acked = 0
+        self._live = []
+        self._live_lock = threading.Lock()
+        self._done = []
+        self._cursor = 0
+        self._first = True
+        self._failed = False
+        self._ack_lock = threading.Lock()
+        self.reset()
+
+        # Progress, in frames posted and frames per second
+        self._posted = 0
+        self._rate = 0.0
+        self._reported = 0
+        self.lastsent = time.time()
+        self.lastsentstatus = time.time()
+
+    def run(self):
+        """Post the frames when due until stopped."""
+
+        while not self.stop and not self._interfacer.stop:
+            self._wakeup.wait(1.0)
+            self._wakeup.clear()
+            try:
+                with self.busy:
+                    if self.buffer is not self._interfacer.buffer:
+                        # Added while the interfacer was switching buffers
+                        self.reset()
+                    self._send()
+            except Exception:
+                import traceback
+                self._log.warning(self.name + " failed, Exception: " + traceback.format_exc())
+                time.sleep(1)
+
+    def wake(self):
+        """Check whether a post is due now."""
+
+        self._wakeup.set()
+
+    def reset(self):
+        """Start afresh with the interfacer's (new) buffer."""
+
+        buf = self._interfacer.buffer
+        with self._ack_lock:
+            # The buffer acked and the positions refer to
+            self.buffer = buf
+            self.acked = 0
+            if buf is not None:
+                # Frames beyond the buffer's last may have been lost with a power cut
+                saved = min(buf.positions().get(self.key, 0), buf.last())
+                self.acked = max(buf.acked(), saved)
+            self._done = []
+        with self._live_lock:
+            self._live = []
+
+    def add_live(self, frames):
+        """Add (seq, frame) newly stored, to be posted ahead of any backlog."""
+
+        maxframes = self._interfacer._maxframes
+        with self._live_lock:
+            self._live.extend(frames)
+            if len(self._live) > maxframes:
+                del self._live[:len(self._live) - maxframes]
+
+    def _send(self):
+        """Post the frames waiting and the status when due."""
+
+        I = self._interfacer
+        self._batch = min(self._batch, I._maxframes)
+        self._rps.rate = I._maxrps
+        self._bps.rate = I._maxbps
+
+        now = time.time()
+        if int(I._settings['senddata']) and self._waiting() and \
+                now >= self._retry_at and self._flush_due(now):
+            self.lastsent = now
+            self._flush()
+
+        if (now-self.lastsentstatus)>60:
+            self.lastsentstatus = now
+            if int(I._settings['sendstatus']):
+                self.sendstatus()
+
+    def _waiting(self):
+        """Return the number of frames waiting to be posted to this target."""
+
+        buf = self._interfacer.buffer
+        return buf.last() - max(self.acked, buf.acked())
+
+    def _flush_due(self, now):
+        """Return True once maxframes or maxbytes are waiting, or maxage has passed."""
+
+        I = self._interfacer
+        buf = I.buffer
+        return self._waiting() >= I._maxframes or \
+            buf.size_after(max(self.acked, buf.acked())) >= I._maxbytes or \
+            now - self.lastsent >= I._maxage
+
+    def _flush(self):
+        """Post the frames waiting in the buffer.
+
+        Frames are posted in chunks of up to the batch size (and maxbytes),
+        one after the other while full chunks are waiting.
+
+        To catch up on a backlog, the newest frames are posted first. The
+        backlog is then posted over 'workers' connections at once until the
+        next post of new frames is due, within the maxrps and maxbps limits.
+
+        """
+
+        I = self._interfacer
+        self._failed = False
+        self._first = True
+        self._cursor = max(self.acked, I.buffer.acked())
+        with self._live_lock:
+            live = [f for f in self._live if f[0] > self._cursor]
+            self._live = []
+
+        if self._waiting() - len(live) <= self._batch:
+            self._post_chunks(None)
+        else:
+            start = time.time()
+            posted = self._posted
+            while live and not self._failed:
+                frames = self._trim(live[:self._batch])
+                live = live[len(frames):]
+                self._failed = not self._post(frames)
+
+            workers = [threading.Thread(target=self._post_chunks, args=(self.lastsent + I._maxage,),
+                                        name=self.name + "-catchup" + str(i + 1))
+                       for i in range(I._workers)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            self._report(start, self._posted - posted)
+
+        if self._failed:
+            # Wait before trying again, however many frames are waiting
+            self._retry_at = time.time() + I._maxage
+
+    def _post_chunks(self, deadline):
+        """Post chunks of the waiting frames until none are left or the deadline passes.
+
+        At least one chunk is posted, so the backlog goes down however soon
+        the deadline is.
+
+        """
+
+        while not self.stop and not self._interfacer.stop and not self._failed:
+            with self._ack_lock:
+                frames = self._next_chunk()
+            if not frames:
+                return
+            if not self._post(frames):
+                self._failed = True
+                return
+            if deadline is not None and time.time() >= deadline:
+                return
+
+    def _next_chunk(self):
+        """Return the next frames to post, skipping those already accepted.
+
+        After the first, only full chunks are returned.
+
+        """
+
+        buf = self._interfacer.buffer
+        if not self._first and buf.last() - self._cursor < self._batch:
+            return None
+        self._first = False
+
+        while True:
+            frames = buf.peek(self._batch, self._cursor)
+            if not frames:
+                return None
+            done = [r for r in self._done if r[1] >= frames[0][0]]
+            if done and done[0][0] <= frames[0][0]:
+                self._cursor = done[0][1]
+                continue
+            if done:
+                frames = [f for f in frames if f[0] < done[0][0]]
+            break
+
+        frames = self._trim(frames)
+        self._cursor = frames[-1][0]
+        return frames
+
+    def _trim(self, frames):
+        """Return as many of the frames as fit in maxbytes (at least one)."""
+
+        maxbytes = self._interfacer._maxbytes
+        size = 0
+        for i, (seq, frame) in enumerate(frames):
+            size += len(frame) + 1
+            if size > maxbytes and i:
+                return frames[:i]
+        return frames
+
+    def _post(self, frames):
+        """Post a chunk of (seq, frame) and acknowledge it if accepted."""
+
+        self._rps.acquire(1)
+        self._bps.acquire(sum([len(f) + 1 for seq, f in frames]))
+        start = time.time()
+        ok = self.bulkpost([f for seq, f in frames])
+        with self._ack_lock:
+            self._adapt(ok, time.time() - start)
+            if ok:
+                self._ack(frames[0][0], frames[-1][0])
+                self._posted += len(frames)
+        if ok:
+            self._interfacer._ack()
+        return ok
+
+    def _ack(self, first, last):
+        """Record frames first to last as accepted, advance acked over all accepted without a gap."""
+
+        self._done.append((first, last))
+        self._done.sort()
+        acked = max(self.acked, self._interfacer.buffer.acked())
+        while self._done and self._done[0][0] <= acked + 1:
+            acked = max(acked, self._done.pop(0)[1])
+        self.acked = acked
+
+    def _report(self, start, posted):
+        """Update the send rate and report the progress catching up."""
+
+        elapsed = time.time() - start
+        if elapsed > 0:
+            rate = posted / elapsed
+            self._rate = rate if not self._rate else 0.7 * self._rate + 0.3 * rate
+
+        if time.time() - self._reported >= REPORT_INTERVAL:
+            self._reported = time.time()
+            stats = self.stats()
+            self._log.info(self.name + " catching up with " + self.url + ", " + str(stats['backlog']) +
+                           " frames waiting, " + str(stats['rate']) + " frames/s, ETA " +
+                           str(stats['eta']) + "s")
+
+    def stats(self):
+        """Return the backlog in frames, the send rate (frames/s) and the
+        estimated seconds to send the backlog as a dict."""
+
+        backlog = self._waiting()
+        return {'backlog': backlog, 'rate': round(self._rate, 1),
+                'eta': int(backlog / self._rate) if self._rate else None}
+
+    def _adapt(self, ok, rtt):
+        """Adapt the batch size to the server.
+
+        Grow it a step at a time while posts are accepted quickly, halve it
+        when a post fails or the reply is slow.
+
+        """
+
+        maxframes = self._interfacer._maxframes
+        if ok and rtt < TARGET_RTT:
+            batch = min(maxframes, self._batch + max(1, maxframes // 10))
+        else:
+            batch = max(min(MIN_BATCH, maxframes), self._batch // 2)
+        if batch != self._batch:
+            self._log.debug(self.name + " batch size " + str(batch) + " frames (post took " +
+                            str(round(rtt, 2)) + "s)")
+            self._batch = batch
+
+    def bulkpost(self,databuffer):
+        """Post a list of frames, each already serialized as JSON.
+
+        Return True if the server accepted them.
+
+        """
+    
+        if str.__len__(self.apikey) != 32 or str.lower(self.apikey) == 'xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx':
+            return
+            
+        # Prepare URL string of the form
+        # http://domain.tld/emoncms/input/bulk.json?apikey=12345
+        # &data=[[0,10,82,23],[5,10,82,23],[10,10,82,23]]
+        # &sentat=15' (requires emoncms >= 8.0)
+
+        # time that the request was sent at
+        sentat = int(time.time())
+
+        # Construct post_url (without apikey)
+        post_url = self.url+'/input/bulk'+'.json?apikey='
+
+        # The body is kept as a list of pieces, sent as they come rather
+        # than joined into one (backlog sized) string
+        post_body = ["data=["]
+        for i, frame in enumerate(databuffer):
+            if i:
+                post_body.append(",")
+            post_body.append(frame)
+        post_body.append("]&sentat="+str(sentat))
+
+        # logged before apikey added for security
+        self._log.info("sending: " + post_url + "E-M-O-N-C-M-S-A-P-I-K-E-Y& " + str(len(databuffer)) +
+                       " frames, " + str(sum([len(p) for p in post_body])) + " bytes")
+        if self._log.isEnabledFor(logging.DEBUG):
+            self._log.debug("sending: " + "".join(post_body))
+
+        headers = {}
+        if str(self._interfacer._settings['compress']).lower() == 'gzip':
+            post_body = self._interfacer._gzip(post_body)
+            headers['Content-Encoding'] = 'gzip'
+
+        # Add apikey to post_url
+        post_url = post_url + self.apikey
+
+        # The Develop branch of emoncms allows for the sending of the apikey in the post
+        # body, this should be moved from the url to the body as soon as this is widely
+        # adopted
+
+        reply = self._interfacer._send_post(post_url, post_body, headers)
+        if reply == 'ok':
+            self._log.debug("acknowledged receipt with '" + reply + "' from " + self.url)
+            return True
+        else:
+            self._log.warning("send failure: wanted 'ok' but got '" +reply+ "'")
+
+    def sendstatus(self):
+        # MYIP url
+        post_url = self.url+'/myip/set.json?apikey='
+        # Print info log
+        self._log.info("sending: " + post_url + "E-M-O-N-C-M-S-A-P-I-K-E-Y")
+        # add apikey
+        post_url = post_url + self.apikey
+        # send request
+        reply = self._interfacer._send_post(post_url,None)
@@ -1,5 +1,9 @@
 
 import time
+import logging
+import datetime
+import threading
+import collections
 from pydispatch import dispatcher
 
 import Cargo
@@ -9,46 +13,69 @@ import EmonHubSerialInterfacer as ehi
 
 Monitors the serial port for data from "Jee" type device
 
+With rxformat = binary the device sends received packets as raw
+length-prefixed frames rather than "OK 10 23 0 ..." text lines:
+
+    SOH (0x01) | payload length | node id | payload bytes | RSSI (signed byte)
+
+Anything outside a frame (command acknowledgements, device settings etc.)
+is still read as lines of text.
+
+Commands (settings and packets to send) are queued and written to the
+device one at a time from the interfacer's thread, in between reading
+frames. A command is taken as done once the device acknowledges it: a
+"> <command>" line for a setting, a "-> <n> b" line for a packet sent,
+the device settings line for "v". A command not acknowledged within
+COMMAND_TIMEOUT seconds is written again, up to COMMAND_RETRIES times.
+
 """
 
+# Start of a binary frame
+SOH = 0x01
+
+# Seconds to wait for a command to be acknowledged
+COMMAND_TIMEOUT = 1.0
+
+# Times a setting is written again if not acknowledged (packets aren't)
+COMMAND_RETRIES = 2
+
+# Most commands waiting to be written
+COMMAND_QUEUE = 100
+
 class EmonHubJeeInterfacer(ehi.EmonHubSerialInterfacer):
 
-    def __init__(self, name, com_port='/dev/ttyAMA0', com_baud=0):
+    def __init__(self, name, com_port='/dev/ttyAMA0', com_baud=0, rxformat='ascii'):
         """Initialize Interfacer
 
         com_port (string): path to COM port
+        rxformat (string): 'ascii' (default) or 'binary' received frames
 
         """
 
+        if rxformat not in ['ascii', 'binary']:
+            raise ehi.EmonHubInterfacerInitError("Invalid rxformat '%s'" % rxformat)
+        self._rxformat = rxformat
+
         # Initialization
         if com_baud != 0:
             super(EmonHubJeeInterfacer, self).__init__(name, com_port, com_baud)
         else:
             super(EmonHubJeeInterfacer, self).__init__(name, com_port, 38400)
         
-        # Display device firmware version and current settings
+        # Commands waiting to be written, each [command, acknowledgement
+        # ('>', '->', 'v' or None), retries left, time written], and the
+        # one written waiting for its acknowledgement
+        self._commands = collections.deque()
+        self._command = None
+        self._commands_lock = threading.Lock()
+
+        # Ask for the device firmware version and current settings, the
+        # settings are sent once they are known (see _device_info)
         self.info = ["",""]
-        if self._ser is not None:
-            self._ser.write("v")
-            time.sleep(2)
-            self._rx_buf = self._rx_buf + self._ser.readline()
-            if '\r\n' in self._rx_buf:
-                self._rx_buf=""
-                info = self._rx_buf + self._ser.readline()[:-2]
-                if info != "":
-                    # Split the returned "info" string into firmware version & current settings
-                    self.info[0] = info.strip().split(' ')[0]
-                    self.info[1] = info.replace(str(self.info[0]), "")
-                    self._log.info( self.name + " device firmware version: " + self.info[0])
-                    self._log.info( self.name + " device current settings: " + str(self.info[1]))
-                else:
-                    # since "v" command only v11> recommend firmware update ?
-                    #self._log.info( self.name + " device firmware is pre-version RFM12demo.11")
-                    self._log.info( self.name + " device firmware version & configuration: not available")
-            else:
-                self._log.warning("Device communication error - check settings")
-        self._rx_buf=""
+        self._info_pending = True
+        self._deferred = None
         self._ser.flushInput()
+        self._queue_command("v", 'v')
 
         # Initialize settings
         self._defaults.update({'pause': 'off', 'interval': 0, 'datacode': 'h'})
@@ -62,10 +89,6 @@ class EmonHubJeeInterfacer(ehi.EmonHubSerialInterfacer):
         self._jee_settings =  ({'baseid': '15', 'frequency': '433', 'group': '210', 'quiet': 'True', 'calibration': '230V'})
         self._jee_prefix = ({'baseid': 'i', 'frequency': '', 'group': 'g', 'quiet': 'q', 'calibration': 'p'})
 
-        # Pre-load Jee settings only if info string available for checks
-        if all(i in self.info[1] for i in (" i", " g", " @ ", " MHz")):
-            self._settings.update(self._jee_settings)
-
     def read(self):
         """Read data from serial port and process if complete line received.
 
@@ -73,18 +96,26 @@ class EmonHubJeeInterfacer(ehi.EmonHubSerialInterfacer):
 
         """
 
-        # Read serial RX
-        self._rx_buf = self._rx_buf + self._ser.readline()
+        if self._rxformat == 'binary':
+            return self._read_binary()
 
+        # Read serial RX, unless a complete line is still buffered
+        if not self._rx.has_line():
+            self._rx.fill(self._ser)
+
+        f = self._rx.line()
         # If line incomplete, exit
-        if '\r\n' not in self._rx_buf:
+        if f is None:
             return
 
-        # Remove CR,LF.
-        f = self._rx_buf[:-2].strip()
+        return self._parse_line(f.strip())
+
+    def _parse_line(self, f):
+        """Process a line of text received from the device.
 
-        # Reset buffer
-        self._rx_buf = ''
+        Return a cargo if the line holds a received packet
+
+        """
 
         if not f:
             return
@@ -101,14 +132,17 @@ class EmonHubJeeInterfacer(ehi.EmonHubSerialInterfacer):
         if '>' in f:
             if '->' in f:
                 self._log.debug("confirmed sent packet size: " + str(f))
+                self._acknowledge('->', f)
                 return
             self._log.debug("acknowledged command: " + str(f))
+            self._acknowledge('>', f)
             return
 
         # Record current device settings
         if " i" and " g" and " @ " and " MHz" in f:
-            self.info[1] = f
-            self._log.debug("device settings updated: " + str(self.info[1]))
+            if not self._acknowledge('v', f):
+                self.info[1] = f
+                self._log.debug("device settings updated: " + str(self.info[1]))
             return
 
         # Save raw packet to new cargo object
@@ -140,6 +174,66 @@ class EmonHubJeeInterfacer(ehi.EmonHubSerialInterfacer):
 
         return c
 
+    def _rx_pending(self):
+        """Return True if data is waiting at the serial port or a complete
+        binary frame or line is buffered."""
+
+        if self._rxformat == 'binary' and self._rx_frame():
+            return True
+        return super(EmonHubJeeInterfacer, self)._rx_pending()
+
+    def _rx_frame(self):
+        """Return True if a complete binary frame or line of text is buffered."""
+
+        rx = self._rx
+        if not len(rx):
+            return False
+        if rx[0] == SOH:
+            return len(rx) >= 3 and len(rx) >= rx[1] + 4
+        return rx.has_line()
+
+    def _read_binary(self):
+        """Read data from serial port and process the first complete binary frame.
+
+        Text lines received between frames are passed to _parse_line.
+
+        Return a cargo holding the payload as a bytearray
+
+        """
+
+        # Read everything waiting in one go, unless a complete frame is still buffered
+        if not self._rx_frame():
+            self._rx.fill(self._ser)
+
+        rx = self._rx
+        while len(rx):
+            if rx[0] != SOH:
+                # Not a frame, process the text up to the end of line
+                f = rx.line()
+                if f is None:
+                    return
+                c = self._parse_line(f.strip())
+                if c:
+                    return c
+                continue
+
+            # Wait for the rest of the frame
+            if len(rx) < 3 or len(rx) < rx[1] + 4:
+                return
+
+            frame = rx.take(rx[1] + 4)
+            length = frame[1]
+            c = Cargo.new_cargo(realdata=frame[3:3 + length])
+            c.nodeid = frame[2] + int(self._settings['nodeoffset'])
+            rssi = frame[3 + length]
+            c.rssi = rssi - 256 if rssi > 127 else rssi
+
+            # Only render the frame as text if it is going to be logged
+            if self._log.isEnabledFor(logging.DEBUG):
+                c.rawdata = "OK " + str(c.nodeid) + " " + " ".join([str(b) for b in c.realdata]) + \
+                            " (" + str(c.rssi) + ")"
+            return c
+
         # # unix timestamp
         # t = round(time.time(), 2)
         #
@@ -155,6 +249,20 @@ class EmonHubJeeInterfacer(ehi.EmonHubSerialInterfacer):
         
         """
 
+        with self._commands_lock:
+            deferred = self._info_pending
+            if deferred:
+                # Wait for the device's current settings, see _device_info
+                self._deferred = kwargs
+        if not deferred:
+            self._configure(kwargs)
+
+        # include kwargs from parent
+        super(EmonHubJeeInterfacer, self).set(**kwargs)
+
+    def _configure(self, kwargs):
+        """Queue the commands for the "Jee" settings that differ from the device's."""
+
         for key, setting in self._jee_settings.iteritems():
             # Decide which setting value to use
             if key in kwargs.keys():
@@ -189,12 +297,105 @@ class EmonHubJeeInterfacer(ehi.EmonHubSerialInterfacer):
                 continue
             self._settings[key] = setting
             self._log.info("Setting " + self.name + " %s: %s" % (key, setting) + " (" + command + ")")
-            self._ser.write(command)
-            # Wait a sec between two settings
-            time.sleep(1)
+            self._queue_command(command, '>')
+
+    def _device_info(self, info):
+        """Record the device's firmware version & settings (None if not
+        available), then send the settings waiting for them."""
+
+        if info:
+            # Split the returned "info" string into firmware version & current settings
+            self.info[0] = info.strip().split(' ')[0]
+            self.info[1] = info.replace(str(self.info[0]), "")
+            self._log.info( self.name + " device firmware version: " + self.info[0])
+            self._log.info( self.name + " device current settings: " + str(self.info[1]))
+        else:
+            # since "v" command only v11> recommend firmware update ?
+            self._log.warning( self.name + " device firmware version & configuration: not available" +
+                              " - check settings")
 
-        # include kwargs from parent
-        super(EmonHubJeeInterfacer, self).set(**kwargs)
+        # Pre-load Jee settings only if info string available for checks
+        if all(i in self.info[1] for i in (" i", " g", " @ ", " MHz")):
+            self._settings.update(self._jee_settings)
+
+        with self._commands_lock:
+            self._info_pending = False
+            kwargs = self._deferred
+            self._deferred = None
+        if kwargs is not None:
+            self._configure(kwargs)
+
+    def _queue_command(self, command, ack, retries=COMMAND_RETRIES):
+        """Queue a command to be written to the device.
+
+        ack is the acknowledgement waited for, '>', '->', 'v' or None for none.
+
+        """
+
+        with self._commands_lock:
+            if len(self._commands) >= COMMAND_QUEUE:
+                self._log.warning(self.name + " command queue full, discarding: " + command)
+                return
+            self._commands.append([command, ack, retries, 0])
+
+    def _acknowledge(self, ack, f):
+        """Match a line from the device to the command waiting for it.
+
+        Return True if it was the acknowledgement waited for.
+
+        """
+
+        with self._commands_lock:
+            command = self._command
+            if command is None or command[1] != ack:
+                return False
+            if ack == '>':
+                echo = f.split('>', 1)[1].strip()
+                if echo != command[0] and echo[-1:] != command[0][-1:]:
+                    return False
+            self._command = None
+        self._log.debug(self.name + " command " + command[0] + " done in " +
+                        str(round(time.time() - command[3], 3)) + "s")
+        if ack == 'v':
+            self._device_info(f)
+        self._write_commands()
+        return True
+
+    def _write_commands(self):
+        """Write the queued commands, each once the last one is acknowledged.
+
+        Called from the interfacer's thread, between reads.
+
+        """
+
+        while True:
+            now = time.time()
+            with self._commands_lock:
+                command = self._command
+                if command is not None:
+                    if now - command[3] < COMMAND_TIMEOUT:
+                        return
+                    if command[2] <= 0:
+                        self._command = None
+                elif self._commands:
+                    command = self._commands.popleft()
+                    if command[1] is not None:
+                        self._command = command
+                else:
+                    return
+
+            if command[3] and command[2] <= 0:
+                # Not acknowledged, give up on it
+                self._log.warning(self.name + " command " + command[0] + " not acknowledged")
+                if command[1] == 'v':
+                    self._device_info(None)
+                continue
+            if command[3]:
+                # Not acknowledged, try again
+                command[2] -= 1
+            command[3] = now
+            self._log.debug(self.name + " writing command: " + command[0])
+            self._ser.write(command[0])
 
     def action(self):
         """Actions that need to be done on a regular basis. 
@@ -203,6 +404,9 @@ class EmonHubJeeInterfacer(ehi.EmonHubSerialInterfacer):
         
         """
 
+        # Write the commands due
+        self._write_commands()
+
         t = time.time()
 
         # Broadcast time to synchronize emonGLCD
@@ -218,7 +422,7 @@ class EmonHubJeeInterfacer(ehi.EmonHubSerialInterfacer):
             #self._log.debug(self.name + " non-DST adjusted time: %02d:%02d" % (dst, mm))
             self._interval_timestamp = t
             n = 0 + int(self._settings['nodeoffset'])
-            packet = new_cargo( realdata = [0,hh,mm,0], target=n)
+            packet = Cargo.new_cargo( realdata = [0,hh,mm,0], target=n)
             self._log.debug(str(packet.uri) + " broadcast time: %02d:%02d" % (hh, mm))
 
             self.send(packet)
@@ -260,5 +464,7 @@ class EmonHubJeeInterfacer(ehi.EmonHubSerialInterfacer):
         payload += cmd
         
         self._log.debug(str(f.uri) + " sent TX packet: " + payload)
-        self._ser.write(payload)
+        # Sent once, a packet may have gone even if not acknowledged
+        self._queue_command(payload, '->', 0)
+        self._write_commands()
 
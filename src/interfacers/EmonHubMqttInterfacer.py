@@ -1,12 +1,74 @@
 """class EmonHubMqttGenInterfacer
 
+The MQTT client's network I/O is run by a thread of its own (or the
+reactor), so incoming messages are handled as soon as they arrive and a
+broker that can't be reached never holds up the interfacer. Reconnects are
+retried with an exponential backoff, from reconnect_min to reconnect_max
+seconds, with jitter so several hubs don't all retry at once.
+
+The client is only ever used from that one thread: messages to publish
+are handed over to it, so its packets are written to the socket by a
+single thread, in order. The time from a message being handed over to it
+being sent is logged every REPORT_INTERVAL seconds, with a warning if it
+goes over MAX_LATENCY or more than MAX_PENDING messages are waiting.
+
+Received frames are published as topics set by 'topics':
+
+    values  basetopic/rx/<nodeid>/values, all the values comma separated
+            (default)
+    inputs  basetopic/<nodename>/<name>, each value on its own topic, named
+            from the node's [nodes] settings (the nodeid and the value's
+            position are used when not listed)
+    both    both of the above
+
+With 'coalesce' set to N ms, each topic is published only every N ms with
+its latest value.
+
+Frames to send are received on basetopic/tx/<nodeid>/values, the values
+comma separated, or many at once on basetopic/tx/bulk, as a JSON array of
+[timestamp, nodeid, value, ...] frames, or basetopic/tx/bulk/binary (see
+_bulk_cargos). Bulk frames are data to store rather than to send on, so
+they go to the 'bulkchannels' instead of the pubchannels.
+
+While the broker can't be reached, messages are kept in a buffer (in
+memory, or on disk to also survive restarts) of up to buffersize MB, the
+oldest dropped when full. Once reconnected they are published in order
+with the 'qos' set, at most 'inflight' at a time, and only removed from
+the buffer once sent (qos 0) or acknowledged by the broker (qos 1 & 2).
+
 """
+import os
 import time
+import json
+import errno
+import fcntl
+import struct
+import random
+import select
+import socket
+import threading
+import collections
 import paho.mqtt.client as mqtt
+import emonhub_coder as ehc
 from pydispatch import dispatcher
 from emonhub_interfacer import EmonHubInterfacer
+from emonhub_buffer import EmonHubMemoryBuffer, EmonHubDiskBuffer
 import Cargo
 
+# Header of each frame of a binary bulk message: timestamp, nodeid, number of values
+BULK_HEADER = struct.Struct('<dHB')
+
+# Seconds between two reports of the stats
+REPORT_INTERVAL = 60
+
+# Latency (seconds) and messages waiting to be sent above which a report warns
+MAX_LATENCY = 5.0
+MAX_PENDING = 100
+
+# Seconds to wait on stopping for the network thread to finish
+SHUTDOWN_TIMEOUT = 5
+
+
 class EmonHubMqttInterfacer(EmonHubInterfacer):
 
     def __init__(self, name, mqtt_host="127.0.0.1", mqtt_port=1883):
@@ -22,25 +84,243 @@ class EmonHubMqttInterfacer(EmonHubInterfacer):
         self._settings = {
             'subchannels':['ch1'],
             'pubchannels':['ch2'],
-            'basetopic': 'emonhub/'
+            'bulkchannels':['ToEmonCMS'],
+            'queuesize': 1000,
+            'overflow': 'dropoldest',
+            'basetopic': 'emonhub/',
+            'reconnect_min': 1,
+            'reconnect_max': 60,
+            'topics': 'values',
+            'coalesce': 0,
+            'qos': 0,
+            'inflight': 20,
+            'buffer': 'memory',
+            'bufferdir': '/var/lib/emonhub',
+            'buffersize': 1
         };
 
+        # Messages waiting for the broker, opened by set()
+        self.buffer = None
+        self._buffer_settings = None
+
+        # Messages from the buffer published and not yet sent or acknowledged,
+        # oldest first as [seq, done], the same by mid, and the last one taken
+        self._inflight = collections.deque()
+        self._inflight_mids = {}
+        self._queued = 0
+        self._queue_lock = threading.Lock()
+
+        # Topics for each node's frames, (nodeid, number of values):
+        # (values topic, (input topics)), built for the current registry
+        self._topics = {}
+        self._registry = None
+
+        # Latest payload of each topic waiting for the coalesce window to end,
+        # topic: payload, and when the window ends
+        self._coalesced = {}
+        self._coalesce_at = 0
+
+        # Network thread, started by action() unless run by a reactor, the
+        # messages handed over to it as (topic, payload, time handed over),
+        # and a pipe to wake it
+        self._net = None
+        self._outbox = collections.deque()
+        self._wake_r, self._wake_w = os.pipe()
+        fcntl.fcntl(self._wake_w, fcntl.F_SETFL, fcntl.fcntl(self._wake_w, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+        # When to try connecting next, and the backoff delay before that
+        self._retry_at = 0
+        self._delay = 0
+        self._connecting = False
+
+        # Messages published and waiting to be sent, mid: time handed over
+        self._lock = threading.Lock()
+        self._sent = {}
+
+        # Counters, and hand over to send latency in seconds
+        self.published = 0
+        self.delivered = 0
+        self.lost = 0
+        self._latency = 0.0
+        self._maxlatency = 0.0
+        self._reported = time.time()
+
         self._mqttc = mqtt.Client()
         self._mqttc.on_connect = self.on_connect
         self._mqttc.on_disconnect = self.on_disconnect
         self._mqttc.on_message = self.on_message
         self._mqttc.on_subscribe = self.on_subscribe
+        self._mqttc.on_publish = self.on_publish
         
 
     def action(self):
-        if not self._connected:
-            self._log.info("Connecting to MQTT Server")
-            try:
-                self._mqttc.connect(self._host, self._port, 60)
-            except:
-                self._log.info("Could not connect...")
-                time.sleep(1.0)
-        self._mqttc.loop(0)
+        if self._coalesced and time.time() >= self._coalesce_at:
+            self._flush_coalesced()
+        if time.time() - self._reported >= REPORT_INTERVAL:
+            self._report()
+
+        if self._reactor is None:
+            # Start the network thread the first time round
+            if self._net is None:
+                self._net = threading.Thread(target=self._net_loop, name=self.name + "-network")
+                self._net.daemon = True
+                self._net.start()
+            return
+
+        # Connect from one of the reactor's workers, connect() may block.
+        # The socket is left alone by the reactor until it is done
+        if self._connecting:
+            return
+        if self._mqttc.socket() is None and time.time() >= self._retry_at:
+            self._connecting = True
+            self._run_blocking(self._connect, self._connect_done)
+            return
+        self._drain_queue()
+        self._mqttc.loop_misc()
+
+    def close(self):
+        """Stop the network thread, then close the buffer."""
+
+        if self._net is None:
+            # Run by the reactor, which has let go of the client
+            self._stop_client()
+        else:
+            self._wake()
+            self._net.join(SHUTDOWN_TIMEOUT)
+            if self._net.isAlive():
+                self._log.warning(self.name + " network thread still busy, messages not yet buffered may be lost")
+        self.buffer.close()
+
+    def _net_loop(self):
+        """Run the MQTT client until stopped, the only thread using it."""
+
+        while not self.stop:
+            if self._mqttc.socket() is None:
+                # Buffer what is handed over until connected
+                self._send_outbox()
+                wait = self._retry_at - time.time()
+                if wait > 0:
+                    self._wait(None, min(wait, 0.5))
+                else:
+                    self._connect()
+                continue
+            self._send_outbox()
+            self._drain_queue()
+            # Returns as soon as there is something to read or write, a
+            # message is handed over, or after a second to keep alive. A lost
+            # connection is handled by on_disconnect()
+            self._wait(self._mqttc.socket(), 1.0)
+
+        self._stop_client()
+
+    def _stop_client(self):
+        """Buffer the messages not yet published and disconnect."""
+
+        self._connected = False
+        self._send_outbox()
+        try:
+            self._mqttc.disconnect()
+        except Exception:
+            pass
+
+    def _wait(self, sock, timeout):
+        """Wait up to timeout seconds for the client's socket (if any) or a
+        message handed over, then let the client read, write and keep alive."""
+
+        rfds = [self._wake_r]
+        wfds = []
+        if sock is not None:
+            rfds.append(sock)
+            if self._mqttc.want_write():
+                wfds.append(sock)
+        try:
+            r, w, x = select.select(rfds, wfds, [], timeout)
+        except (select.error, socket.error, ValueError):
+            # The socket was closed meanwhile
+            return
+        if self._wake_r in r:
+            os.read(self._wake_r, 4096)
+        if sock is None:
+            return
+        if sock in r:
+            self._mqttc.loop_read()
+        if sock in w and self._mqttc.socket() is not None:
+            self._mqttc.loop_write()
+        self._mqttc.loop_misc()
+
+    def _wake(self):
+        """Wake the network thread, eg when a message is handed over."""
+
+        try:
+            os.write(self._wake_w, b'.')
+        except OSError as e:
+            # Full, it will wake anyway
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def _connect(self):
+        """Try to connect to the broker, scheduling the next try if it fails.
+
+        Return True if connected.
+
+        """
+
+        self._log.info("Connecting to MQTT Server")
+        try:
+            self._mqttc.connect(self._host, self._port, 60)
+        except Exception as e:
+            self._log.info("Could not connect... " + str(e))
+            self._backoff()
+            return False
+        return True
+
+    def _connect_done(self, connected):
+        self._connecting = False
+
+    def _backoff(self):
+        """Schedule the next try to connect, doubling the delay each time."""
+
+        s = self._settings
+        try:
+            low, high = float(s['reconnect_min']), float(s['reconnect_max'])
+        except ValueError:
+            low, high = 1.0, 60.0
+        self._delay = min(high, max(low, self._delay * 2))
+        # Anywhere from half to all of the delay
+        delay = self._delay * random.uniform(0.5, 1.0)
+        self._retry_at = time.time() + delay
+        self._log.info("Retrying in " + str(round(delay, 1)) + "s")
+
+    def _disconnected(self):
+        """Forget the messages lost with the connection and schedule a reconnect."""
+
+        self._connected = False
+        # Messages with qos 1 & 2 are sent again by the client once reconnected
+        if int(self._settings['qos']) == 0:
+            with self._lock:
+                self.lost += len(self._sent)
+                self._sent = {}
+                # Publish the buffered messages not yet sent again
+                self._inflight.clear()
+                self._inflight_mids = {}
+                self._queued = self.buffer.acked()
+        self._backoff()
+
+    def _reactor_fds(self):
+        """Watch the MQTT client's socket, for writing only if it has data to send."""
+
+        sock = self._mqttc.socket()
+        if sock is None or self._connecting:
+            return [], []
+        if self._mqttc.want_write():
+            return [sock.fileno()], [sock.fileno()]
+        return [sock.fileno()], []
+
+    def _on_readable(self, fd):
+        self._mqttc.loop_read()
+
+    def _on_writable(self, fd):
+        self._mqttc.loop_write()
         
     def on_connect(self, client, userdata, flags, rc):
         
@@ -56,25 +336,90 @@ class EmonHubMqttInterfacer(EmonHubInterfacer):
         else:
             self._log.info("connection status: "+connack_string[rc])
             self._connected = True
+            self._delay = 0
             # Subscribe to MQTT topics
             self._mqttc.subscribe(str(self._settings["basetopic"])+"tx/#")
+            # Publish what was buffered while disconnected
+            self._drain_queue()
             
         self._log.debug("CONACK => Return code: "+str(rc))
 
     def on_disconnect(self, client, userdata, rc):
         if rc != 0:
             self._log.info("Unexpected disconnection")
-            self._connected = False
+            self._disconnected()
         
     def on_subscribe(self, mqttc, obj, mid, granted_qos):
         self._log.info("on_subscribe")
 
+    def on_publish(self, client, userdata, mid):
+        """Measure the time from a message being handed over to it being sent.
+
+        Called from the thread that publishes, so the message's mid is known
+        by then, unless publish() sent it straight away (see is_published()).
+
+        """
+
+        now = time.time()
+        with self._lock:
+            entry = self._inflight_mids.pop(mid, None)
+            published = self._sent.pop(mid, None)
+        if entry is not None:
+            # A buffered message, make room for the next
+            entry[1] = True
+            self._ack_queue()
+            self._drain_queue()
+        elif published is not None:
+            self._delivered(now - published)
+
+    def _delivered(self, latency):
+        self.delivered += 1
+        self._latency = 0.9 * self._latency + 0.1 * latency
+        self._maxlatency = max(self._maxlatency, latency)
+
+    def stats(self):
+        """Return the message counters, the messages waiting to be sent and
+        buffered, and the average & largest latency (s) since the last
+        report as a dict."""
+
+        with self._lock:
+            pending = len(self._sent) + len(self._inflight) + len(self._outbox)
+        return {'published': self.published, 'delivered': self.delivered, 'lost': self.lost,
+                'pending': pending, 'buffered': len(self.buffer), 'latency': round(self._latency, 3),
+                'maxlatency': round(self._maxlatency, 3)}
+
+    def _report(self):
+        """Log the stats, with a warning if messages are slow to be sent or piling up."""
+
+        self._reported = time.time()
+        stats = self.stats()
+        report = (self.name + " " + str(stats['delivered']) + " messages sent, " + str(stats['lost']) +
+                  " lost, " + str(stats['pending']) + " pending, " + str(stats['buffered']) +
+                  " buffered, latency " + str(stats['latency']) + "s (max " + str(stats['maxlatency']) + "s)")
+        if stats['maxlatency'] > MAX_LATENCY or stats['pending'] > MAX_PENDING:
+            self._log.warning(report)
+        else:
+            self._log.info(report)
+        self._maxlatency = 0.0
+
     def on_message(self, client, userdata, msg):
         topic_parts = msg.topic.split("/")
         
         if topic_parts[0] == self._settings["basetopic"][:-1]:
-            if topic_parts[1] == "tx":
-                if topic_parts[3] == "values":
+            if topic_parts[1] == "tx" and topic_parts[2:3] == ["bulk"]:
+                binary = topic_parts[3:] == ["binary"]
+                try:
+                    cargos = self._bulk_cargos(msg.payload, binary)
+                except (ValueError, TypeError, IndexError, struct.error) as e:
+                    self._log.warning("Discarded bulk message on " + msg.topic + ": " + str(e))
+                    return
+                self._log.debug("Bulk message on " + msg.topic + ": " + str(len(cargos)) + " frames")
+                # Decoded in one go, but passed on a frame at a time as the
+                # subscribers' receiver() expects
+                for rxc in cargos:
+                    self._publish(rxc, self._settings['bulkchannels'])
+            elif topic_parts[1] == "tx":
+                if topic_parts[3:4] == ["values"]:
                     nodeid = int(topic_parts[2])
                     
                     payload = msg.payload
@@ -87,28 +432,240 @@ class EmonHubMqttInterfacer(EmonHubInterfacer):
                     if rxc:
                         # rxc = self._process_tx(rxc)
                         if rxc:
-                            for channel in self._settings["pubchannels"]:
-                                dispatcher.send(channel, cargo=rxc)
-                                self._log.debug(str(rxc.uri) + " Sent to channel' : " + str(channel))
+                            self._publish(rxc)
+
+    def _bulk_cargos(self, payload, binary):
+        """Return the frames of a bulk message as a list of cargos.
+
+        A JSON message is an array of [timestamp, nodeid, value, ...] frames,
+        a binary one a run of frames, each a BULK_HEADER (timestamp, nodeid,
+        number of values) followed by the values as doubles. A timestamp of
+        0 is the time received. Values are returned as numbers, whole ones as
+        ints, and frames without values are skipped.
+
+        """
+
+        frames = []
+        if not binary:
+            for frame in json.loads(payload):
+                frames.append((float(frame[0] or 0), int(frame[1]), [float(v) for v in frame[2:]]))
+        else:
+            offset = 0
+            while offset < len(payload):
+                timestamp, nodeid, count = BULK_HEADER.unpack_from(payload, offset)
+                offset += BULK_HEADER.size
+                frame = ehc.get_struct('<' + str(count) + 'd')
+                frames.append((timestamp, nodeid, frame.unpack_from(payload, offset)))
+                offset += frame.size
+
+        cargos = []
+        for timestamp, nodeid, values in frames:
+            if not values:
+                self._log.warning("Bulk frame for node " + str(nodeid) + " without values skipped")
+                continue
+            values = [int(v) if v % 1 == 0 else v for v in values]
+            cargos.append(Cargo.new_cargo(realdata=values, nodeid=nodeid, timestamp=timestamp))
+        return cargos
 
     def receiver(self, cargo):
-        if self._connected:
-            topic = self._settings["basetopic"]+"rx/"+str(cargo.nodeid)+"/values"
-            payload = ",".join(map(str,cargo.realdata))
-            
+        values = cargo.realdata
+        topic, inputs = self._node_topics(cargo.nodeid, len(values))
+        mode = self._settings['topics']
+        messages = []
+        if mode != 'inputs':
+            messages.append((topic, ",".join(map(str,values))))
+        if mode != 'values':
+            messages.extend(zip(inputs, map(str, values)))
+
+        if int(self._settings['coalesce']) > 0:
+            # Keep the latest payload of each topic until the window ends
+            self._coalesced.update(messages)
+            if time.time() >= self._coalesce_at:
+                self._flush_coalesced()
+            return
+
+        for topic, payload in messages:
             self._log.info("Publishing: "+topic+" "+payload)
-            result =self._mqttc.publish(topic, payload=payload, qos=0, retain=False)
-            
-            if result[0]==4:
-                self._log.info("Publishing error? returned 4")
+            self._publish_message(topic, payload)
+
+    def _flush_coalesced(self):
+        """Publish the latest payload of each topic and start a new coalesce window."""
+
+        messages = self._coalesced
+        self._coalesced = {}
+        self._coalesce_at = time.time() + int(self._settings['coalesce']) / 1000.0
+        self._log.debug("Publishing " + str(len(messages)) + " coalesced topics")
+        for topic, payload in messages.iteritems():
+            self._publish_message(topic, payload)
+
+    def _drain_queue(self):
+        """Publish the buffered messages, up to 'inflight' at a time."""
+
+        if not self._connected or not len(self.buffer) or not self._queue_lock.acquire(False):
+            return
+        try:
+            with self._lock:
+                room = int(self._settings['inflight']) - len(self._inflight)
+                after = self._queued
+            if room <= 0:
+                return
+            for seq, message in self.buffer.peek(room, after):
+                topic, payload = json.loads(message)
+                info = self._mqttc.publish(str(topic), payload=str(payload),
+                                           qos=int(self._settings['qos']), retain=False)
+                if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                    break
+                self.published += 1
+                with self._lock:
+                    # Sent already if publish() wrote it out straight away
+                    entry = [seq, info.is_published()]
+                    if not entry[1]:
+                        self._inflight_mids[info.mid] = entry
+                    self._inflight.append(entry)
+                    self._queued = seq
+        finally:
+            self._queue_lock.release()
+        self._ack_queue()
+
+    def _ack_queue(self):
+        """Remove the buffered messages sent, up to the first that isn't."""
+
+        seq = None
+        with self._lock:
+            while self._inflight and self._inflight[0][1]:
+                seq = self._inflight.popleft()[0]
+        if seq is not None:
+            self.buffer.ack_through(seq)
+
+    def _node_topics(self, nodeid, count):
+        """Return the topics for a node's frame of count values as
+        (values topic, (input topics)), built once per [nodes] reload."""
+
+        if ehc.registry is not self._registry:
+            self._registry = ehc.registry
+            self._topics = {}
+
+        topics = self._topics.get((nodeid, count))
+        if topics is None:
+            basetopic = str(self._settings["basetopic"])
+            node = self._registry.get(nodeid)
+            names = node.names if node else ()
+            nodename = node.nodename if node and node.nodename else str(nodeid)
+            inputs = tuple([basetopic + nodename + "/" + (names[i] if i < len(names) else str(i + 1))
+                            for i in range(count)])
+            topics = self._topics[(nodeid, count)] = (basetopic + "rx/" + str(nodeid) + "/values", inputs)
+        return topics
+
+    def _publish_message(self, topic, payload):
+        """Publish a message, handing it over to the network thread if there is one."""
+
+        if self._reactor is None:
+            self._outbox.append((topic, payload, time.time()))
+            self._wake()
+            return
+        self._send_message(topic, payload, time.time())
+
+    def _send_outbox(self):
+        """Publish the messages handed over to the network thread."""
+
+        while self._outbox:
+            topic, payload, published = self._outbox.popleft()
+            self._send_message(topic, payload, published)
+
+    def _send_message(self, topic, payload, published):
+        """Publish a message, keeping track of it until it is sent.
+
+        While disconnected, or older messages are still buffered, the
+        message is buffered to be published in order.
+
+        """
+
+        if not self._connected or len(self.buffer) or self._inflight:
+            self._buffer_message(topic, payload)
+            return
+
+        info = self._mqttc.publish(topic, payload=payload, qos=int(self._settings['qos']), retain=False)
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            # Eg the connection has just been lost, publish it once reconnected
+            self._log.info("Publishing failed (" + mqtt.error_string(info.rc) + "), buffered")
+            self._buffer_message(topic, payload)
+            return
+        self.published += 1
+        if info.is_published():
+            # Sent straight away
+            self._delivered(time.time() - published)
+        else:
+            with self._lock:
+                self._sent[info.mid] = published
+
+    def _buffer_message(self, topic, payload):
+        """Buffer a message, to be published after those before it."""
+
+        self.buffer.put([json.dumps([topic, payload], separators=(',', ':'))])
+        self._drain_queue()
     
     def set(self, **kwargs):
         for key,setting in self._settings.iteritems():
             if key in kwargs.keys():
                 # replace default
                 self._settings[key] = kwargs[key]
+
+        if self._settings['topics'] not in ['values', 'inputs', 'both']:
+            self._log.warning("'%s' is not valid for %s: topics" % (self._settings['topics'], self.name))
+            self._settings['topics'] = 'values'
+        if not str(self._settings['coalesce']).isdigit():
+            self._log.warning("'%s' is not valid for %s: coalesce" % (self._settings['coalesce'], self.name))
+            self._settings['coalesce'] = 0
+
+        if str(self._settings['qos']) not in ['0', '1', '2']:
+            self._log.warning("'%s' is not valid for %s: qos" % (self._settings['qos'], self.name))
+            self._settings['qos'] = 0
+        if not str(self._settings['inflight']).isdigit() or int(self._settings['inflight']) < 1:
+            self._log.warning("'%s' is not valid for %s: inflight" % (self._settings['inflight'], self.name))
+            self._settings['inflight'] = 20
+        self._mqttc.max_inflight_messages_set(int(self._settings['inflight']))
+        self._open_buffer()
+
+        # Build the topics again, the basetopic may have changed
+        self._registry = None
         
-        # Subscribe to internal channels   
-        for channel in self._settings["subchannels"]:
-            dispatcher.connect(self.receiver, channel)
-            self._log.debug(self._name+" Subscribed to channel' : " + str(channel))
+        # Subscribe to internal channels
+        self._subscribe()
+
+    def _open_buffer(self):
+        """Open the buffer, or reopen it if its settings have changed."""
+
+        s = self._settings
+        try:
+            maxbytes = int(float(s['buffersize']) * 1024 * 1024)
+        except ValueError:
+            self._log.warning("'%s' is not valid for %s: buffersize" % (s['buffersize'], self.name))
+            maxbytes = 1024 * 1024
+        kind = str(s['buffer']).lower()
+        path = os.path.join(str(s['bufferdir']), self.name)
+
+        if self._buffer_settings == (kind, path):
+            self.buffer.maxbytes = maxbytes
+            return
+        self._buffer_settings = (kind, path)
+
+        with self._queue_lock:
+            if self.buffer is not None:
+                self.buffer.close()
+            if kind == 'disk':
+                try:
+                    self.buffer = EmonHubDiskBuffer(path, maxbytes)
+                except (IOError, OSError) as e:
+                    self._log.error(self.name + " unable to open buffer in " + path +
+                                    ", buffering in memory: " + str(e))
+                    kind = 'memory'
+            elif kind != 'memory':
+                self._log.warning("'%s' is not valid for %s: buffer" % (s['buffer'], self.name))
+                kind = 'memory'
+            if kind == 'memory':
+                self.buffer = EmonHubMemoryBuffer(maxbytes)
+
+            with self._lock:
+                self._inflight.clear()
+                self._inflight_mids = {}
+                self._queued = self.buffer.acked()
@@ -2,6 +2,8 @@ import serial
 import time
 from pydispatch import dispatcher
 import emonhub_interfacer as ehi
+from emonhub_interfacer import EmonHubInterfacerInitError
+from Cargo import new_cargo
 
 """class EmonhubSerialInterfacer
 
@@ -26,7 +28,7 @@ class EmonHubSerialInterfacer(ehi.EmonHubInterfacer):
         self._ser = self._open_serial_port(com_port, com_baud)
         
         # Initialize RX buffer
-        self._rx_buf = ''
+        self._rx = EmonHubSerialFramer()
 
     def close(self):
         """Close serial port"""
@@ -58,29 +60,27 @@ class EmonHubSerialInterfacer(ehi.EmonHubInterfacer):
             return s
 
     def read(self):
-        """Read data from serial port and process if complete line received.
+        """Read data from serial port and process the next complete line received.
 
         Return data as a list: [NodeID, val1, val2]
         
         """
 
-        # Read serial RX
-        self._rx_buf = self._rx_buf + self._ser.readline()
-        
+        # Read serial RX, unless a complete line is still buffered
+        if not self._rx.has_line():
+            self._rx.fill(self._ser)
+
+        f = self._rx.line()
         # If line incomplete, exit
-        if '\r\n' not in self._rx_buf:
+        if f is None:
             return
 
-        # Remove CR,LF
-        f = self._rx_buf[:-2]
-
-        # Reset buffer
-        self._rx_buf = ''
-
         # Create a Payload object
         c = new_cargo(rawdata=f)
 
         f = f.split()
+        if not f:
+            return
 
         if int(self._settings['nodeoffset']):
             c.nodeid = int(self._settings['nodeoffset'])
@@ -91,3 +91,97 @@ class EmonHubSerialInterfacer(ehi.EmonHubInterfacer):
 
         return c
 
+    def _rx_pending(self):
+        """Return True if a complete line is buffered or data is waiting in the
+        serial port's input buffer."""
+
+        return self._rx.has_line() or self._ser.inWaiting() > 0
+
+    def _reactor_fds(self):
+        """Watch the serial port for input."""
+
+        return [self._ser.fileno()], []
+
+
+"""class EmonHubSerialFramer
+
+Buffers the bytes received from a serial port and splits them into lines
+(or other frames).
+
+Everything waiting at the port is read in one go into a bytearray that is
+kept from one read to the next. Lines are taken from a read position
+rather than by deleting them from the front of the buffer, the bytes taken
+are only discarded (once) before the next read. A partial line is left in
+the buffer until the rest of it arrives.
+
+"""
+
+# Longest line kept waiting for its end, anything longer is discarded
+MAX_LINE = 4096
+
+
+class EmonHubSerialFramer(object):
+
+    def __init__(self):
+
+        self._buf = bytearray()
+        self._pos = 0
+
+    def __len__(self):
+        """Return the number of bytes not yet taken."""
+
+        return len(self._buf) - self._pos
+
+    def __getitem__(self, i):
+        """Return the value of byte i, counted from the first not yet taken."""
+
+        return self._buf[self._pos + i]
+
+    def fill(self, ser):
+        """Read everything waiting at serial port ser.
+
+        Return the number of bytes read.
+
+        """
+
+        waiting = ser.inWaiting()
+        if not waiting:
+            return 0
+        if self._pos:
+            # Discard what has been taken before adding more
+            del self._buf[:self._pos]
+            self._pos = 0
+        self._buf.extend(ser.read(waiting))
+        return waiting
+
+    def has_line(self):
+        """Return True if a complete line is buffered."""
+
+        return self._buf.find(b'\n', self._pos) >= 0
+
+    def line(self):
+        """Take the next complete line, return it as a string without the
+        line end, or None if there is none."""
+
+        end = self._buf.find(b'\n', self._pos)
+        if end < 0:
+            if len(self) > MAX_LINE:
+                # No line end is coming, don't let the buffer grow for ever
+                self.clear()
+            return None
+        line = str(self._buf[self._pos:end]).rstrip('\r')
+        self._pos = end + 1
+        return line
+
+    def take(self, n):
+        """Take the next n bytes, return them as a bytearray."""
+
+        data = self._buf[self._pos:self._pos + n]
+        self._pos += n
+        return data
+
+    def clear(self):
+        """Discard everything buffered."""
+
+        del self._buf[:]
+        self._pos = 0
@@ -1,5 +1,9 @@
+import socket
+import select
 from pydispatch import dispatcher
 from emonhub_interfacer import EmonHubInterfacer
+from emonhub_interfacer import EmonHubInterfacerInitError
+from Cargo import new_cargo
 
 """class EmonHubSocketInterfacer
 
@@ -63,6 +67,22 @@ class EmonHubSocketInterfacer(EmonHubInterfacer):
         
         """
 
+        self._recv()
+        return self._next_frame()
+
+    def _rx_pending(self):
+        """Return True if a complete frame is waiting in the socket RX buffer."""
+
+        return '\r\n' in self._sock_rx_buf
+
+    def _reactor_fds(self):
+        """Watch the socket for incoming connections."""
+
+        return [self._socket.fileno()], []
+
+    def _recv(self):
+        """Add any data waiting at the socket to the socket RX buffer."""
+
         # Check if data received
         ready_to_read, ready_to_write, in_error = \
             select.select([self._socket], [], [], 0)
@@ -79,6 +99,9 @@ class EmonHubSocketInterfacer(EmonHubInterfacer):
             # Close connection
             conn.close()
 
+    def _next_frame(self):
+        """Process and return the first complete frame in the socket RX buffer."""
+
         # If there is at least one complete frame in the buffer
         if not '\r\n' in self._sock_rx_buf:
             return
@@ -16,7 +16,9 @@ class EmonHubTesterInterfacer(EmonHubInterfacer):
         
         self._settings = {
             'subchannels':['ch1'],
-            'pubchannels':['ch2']
+            'pubchannels':['ch2'],
+            'queuesize': 1000,
+            'overflow': 'dropoldest'
         };
         
 
@@ -36,15 +38,18 @@ class EmonHubTesterInterfacer(EmonHubInterfacer):
                 rxc.nodeid = 10
                 rxc.realdata = [100,200,300]
                 
-                for channel in self._settings["pubchannels"]:
-                    dispatcher.send(channel, cargo=rxc)
-                    self._log.debug(str(rxc.uri) + " Sent to channel' : " + str(channel))
+                self._publish(rxc)
                   
+            # Pass on the cargos from the subscribed channels
+            self._drain_inbox()
+
             # Don't loop to fast
-            time.sleep(0.1)
+            self._inbox.wait(0.1)
             # Action reporter tasks
             # self.action()
 
+        self._inbox.close()
+
     def receiver(self, cargo):
         pass
         
@@ -55,7 +60,5 @@ class EmonHubTesterInterfacer(EmonHubInterfacer):
                 # replace default
                 self._settings[key] = kwargs[key]
         
-        # Subscribe to internal channels   
-        for channel in self._settings["subchannels"]:
-            dispatcher.connect(self.receiver, channel)
-            self._log.debug(self._name+" Subscribed to channel' : " + str(channel))
+        # Subscribe to internal channels
+        self._subscribe()
@@ -0,0 +1,490 @@
+"""
+
+  This code is released under the GNU Affero General Public License.
+
+  OpenEnergyMonitor project:
+  http://openenergymonitor.org
+
+"""
+
+import os
+import time
+import logging
+import itertools
+import threading
+import collections
+
+"""class EmonHubMemoryBuffer
+
+Frames waiting to be sent, held in memory until acknowledged.
+
+Every frame (a string, typically serialized JSON) is given a sequence
+number when stored. A sender peeks at the oldest frames, and only once the
+server has accepted them calls ack_through() with the last one's sequence
+number. Frames that failed to send are simply peeked at again next time.
+
+Senders sharing a buffer can keep their own positions in it, the last
+sequence number each has had accepted, with save_positions().
+
+When the frames waiting take up more than maxbytes, the oldest are dropped.
+
+"""
+
+class EmonHubMemoryBuffer(object):
+
+    def __init__(self, maxbytes):
+
+        # Initialize logger
+        self._log = logging.getLogger("EmonHub")
+
+        self.maxbytes = int(maxbytes)
+        self._frames = collections.deque()
+        self._bytes = 0
+        self._next = 1
+        self._lock = threading.Lock()
+
+        # Bytes ever stored, and the bytes stored before each frame waiting
+        self._stored = 0
+        self._offsets = collections.deque()
+
+        # Senders' positions, name: sequence number
+        self._positions = {}
+
+        # Frames dropped to stay within maxbytes
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._frames)
+
+    def put(self, frames):
+        """Store a list of frames, return the sequence number of the last one."""
+
+        with self._lock:
+            for frame in frames:
+                self._frames.append((self._next, frame))
+                self._offsets.append(self._stored)
+                self._next += 1
+                self._bytes += len(frame)
+                self._stored += len(frame)
+            while self._bytes > self.maxbytes and self._frames:
+                seq, frame = self._frames.popleft()
+                self._offsets.popleft()
+                self._bytes -= len(frame)
+                self.dropped += 1
+            return self._next - 1
+
+    def peek(self, maxframes=None, after=0):
+        """Return up to maxframes of the oldest frames as a list of (seq, frame).
+
+        Only frames with a sequence number greater than after are returned.
+
+        """
+
+        with self._lock:
+            start = 0
+            if self._frames:
+                start = max(0, after + 1 - self._frames[0][0])
+            end = None if maxframes is None else start + maxframes
+            return list(itertools.islice(self._frames, start, end))
+
+    def acked(self):
+        """Return the sequence number of the last frame acknowledged (or dropped)."""
+
+        with self._lock:
+            if self._frames:
+                return self._frames[0][0] - 1
+            return self._next - 1
+
+    def last(self):
+        """Return the sequence number of the last frame stored."""
+
+        return self._next - 1
+
+    def ack_through(self, seq):
+        """Discard the frames up to and including sequence number seq."""
+
+        with self._lock:
+            while self._frames and self._frames[0][0] <= seq:
+                s, frame = self._frames.popleft()
+                self._offsets.popleft()
+                self._bytes -= len(frame)
+
+    def size(self):
+        """Return the number of bytes taken by the frames waiting."""
+
+        return self._bytes
+
+    def size_after(self, seq):
+        """Return the number of bytes taken by the frames after sequence number seq."""
+
+        with self._lock:
+            if not self._frames:
+                return 0
+            i = seq + 1 - self._frames[0][0]
+            if i >= len(self._frames):
+                return 0
+            return self._stored - self._offsets[max(0, i)]
+
+    def positions(self):
+        """Return the senders' positions saved, as a dict of name: sequence number."""
+
+        return dict(self._positions)
+
+    def save_positions(self, positions):
+        """Replace the senders' positions with a dict of name: sequence number."""
+
+        self._positions = dict(positions)
+
+    def sync(self):
+        """Nothing to save for a memory buffer."""
+
+        pass
+
+    def close(self):
+        pass
+
+
+"""class EmonHubDiskBuffer
+
+Frames waiting to be sent, saved on disk until acknowledged.
+
+Works as EmonHubMemoryBuffer, but survives restarts: frames are appended
+to segment files in a directory of their own, one "<seq> <frame>" line
+each. The last acknowledged sequence number is kept in an "acked" file
+and the senders' positions in a "positions" file. Segments are deleted
+once all their frames are acknowledged, or when the segments take up
+more than maxbytes (oldest first).
+
+Writes are flushed to the OS straight away but only synced to disk every
+SYNC_INTERVAL seconds, to spare the SD card. The acked and positions
+files are saved at the same time, each by renaming a synced copy, and
+acknowledged segments are only deleted once the acked file is saved.
+
+A frame cut short by a crash or power cut is discarded when the buffer is
+opened again, and frames acknowledged since the last sync are sent again.
+
+"""
+
+# Largest size of a segment file
+SEGMENT_SIZE = 1024 * 1024
+
+# Seconds between two syncs of the written frames to disk
+SYNC_INTERVAL = 5
+
+
+class EmonHubDiskBuffer(object):
+
+    def __init__(self, path, maxbytes):
+
+        # Initialize logger
+        self._log = logging.getLogger("EmonHub")
+
+        self.path = path
+        self.maxbytes = int(maxbytes)
+        # Keep several segments within the budget, so dropping one doesn't lose all
+        self._segsize = max(4096, min(SEGMENT_SIZE, self.maxbytes // 8))
+        self._lock = threading.Lock()
+
+        # Segments, oldest first, as lists of [first seq, last seq, bytes, filename]
+        self._segments = []
+        self._file = None
+        self._dirty = False
+        self._synced = time.time()
+
+        # Where reading the frame after the last acknowledged one starts,
+        # (segment filename, file offset), and where reading the frame after
+        # the last one of each peek starts
+        self._readpos = None
+        self._peeked = {}
+
+        # Frames dropped to stay within maxbytes
+        self.dropped = 0
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._acked = self._read_acked()
+        self._acked_saved = self._acked
+        self._positions = self._read_positions()
+        self._positions_saved = dict(self._positions)
+        self._recover()
+        self._next = max([self._acked] + [s[1] for s in self._segments]) + 1
+
+        if len(self):
+            self._log.info("Buffer " + path + " has " + str(len(self)) + " frames waiting to be sent")
+
+    def __len__(self):
+        return self._next - 1 - self._acked
+
+    def put(self, frames):
+        """Store a list of frames, return the sequence number of the last one."""
+
+        with self._lock:
+            for frame in frames:
+                if self._file is None or self._segments[-1][2] >= self._segsize:
+                    self._new_segment()
+                line = str(self._next) + " " + frame + "\n"
+                self._file.write(line)
+                segment = self._segments[-1]
+                segment[1] = self._next
+                segment[2] += len(line)
+                self._next += 1
+            self._file.flush()
+            self._dirty = True
+
+            # Drop the oldest segments when over budget
+            while len(self._segments) > 1 and self.size() > self.maxbytes:
+                first, last, size, filename = self._segments[0]
+                lost = last - max(self._acked, first - 1)
+                self._log.warning("Buffer " + self.path + " full, dropping " + str(lost) + " frames")
+                self.dropped += lost
+                self._acked = max(self._acked, last)
+                # Saved before the segment goes, the sequence numbers are never reused
+                self._write_acked()
+                self._remove_segment()
+
+        if time.time() - self._synced > SYNC_INTERVAL:
+            self.sync()
+        return self._next - 1
+
+    def peek(self, maxframes=None, after=0):
+        """Return up to maxframes of the oldest frames as a list of (seq, frame).
+
+        Only frames with a sequence number greater than after are returned.
+
+        """
+
+        with self._lock:
+            after = max(after, self._acked)
+            start = self._peeked.get(after, self._readpos)
+            frames = []
+            for segment in self._segments:
+                if segment[1] <= after:
+                    continue
+                offset = 0
+                if start is not None and start[0] == segment[3]:
+                    offset = start[1]
+                with open(os.path.join(self.path, segment[3]), 'rb') as f:
+                    f.seek(offset)
+                    for line in f:
+                        offset += len(line)
+                        seq, frame = line[:-1].split(" ", 1)
+                        seq = int(seq)
+                        if seq <= after:
+                            continue
+                        frames.append((seq, frame))
+                        if maxframes is not None and len(frames) >= maxframes:
+                            self._hint(seq, segment[3], offset)
+                            return frames
+            return frames
+
+    def acked(self):
+        """Return the sequence number of the last frame acknowledged (or dropped)."""
+
+        return self._acked
+
+    def last(self):
+        """Return the sequence number of the last frame stored."""
+
+        return self._next - 1
+
+    def ack_through(self, seq):
+        """Discard the frames up to and including sequence number seq."""
+
+        with self._lock:
+            if seq <= self._acked:
+                return
+            self._acked = seq
+            self._readpos = self._peeked.get(seq)
+
+        if time.time() - self._synced > SYNC_INTERVAL:
+            self.sync()
+
+    def size(self):
+        """Return the number of bytes taken by the segment files."""
+
+        return sum([s[2] for s in self._segments])
+
+    def size_after(self, seq):
+        """Return the number of bytes taken by the frames after sequence number seq.
+
+        Within the segment seq falls in, the bytes are estimated in proportion
+        to the frames.
+
+        """
+
+        with self._lock:
+            size = 0
+            for first, last, nbytes, filename in self._segments:
+                if last <= seq:
+                    continue
+                if first > seq:
+                    size += nbytes
+                else:
+                    size += nbytes * (last - seq) // (last - first + 1)
+            return size
+
+    def positions(self):
+        """Return the senders' positions saved, as a dict of name: sequence number."""
+
+        with self._lock:
+            return dict(self._positions)
+
+    def save_positions(self, positions):
+        """Replace the senders' positions with a dict of name: sequence number.
+
+        They are written to disk by the next sync().
+
+        """
+
+        with self._lock:
+            self._positions = dict(positions)
+
+    def sync(self):
+        """Make sure the frames written, the last acknowledged sequence number
+        and the senders' positions are saved to disk."""
+
+        with self._lock:
+            if self._file is not None and self._dirty:
+                os.fsync(self._file.fileno())
+            self._dirty = False
+            self._synced = time.time()
+            if self._acked != self._acked_saved:
+                self._write_acked()
+                # Remove the segments that have been sent in full
+                while self._segments and self._segments[0][1] <= self._acked:
+                    if len(self._segments) == 1:
+                        # The segment being written, the next frame starts a new one
+                        self._close_file()
+                    self._remove_segment()
+            if self._positions != self._positions_saved:
+                self._write_positions()
+
+    def close(self):
+        """Sync and close the buffer."""
+
+        self.sync()
+        with self._lock:
+            self._close_file()
+
+    def _hint(self, seq, filename, offset):
+        """Remember where the frame after seq is to be read from."""
+
+        if len(self._peeked) > 1000:
+            self._peeked = {}
+        self._peeked[seq] = (filename, offset)
+
+    def _new_segment(self):
+        """Start a new segment file for the frames from the next sequence number."""
+
+        self._close_file()
+        filename = "%020d.seg" % self._next
+        self._file = open(os.path.join(self.path, filename), 'ab')
+        self._segments.append([self._next, self._next - 1, 0, filename])
+
+    def _remove_segment(self):
+        """Delete the oldest segment file."""
+
+        filename = self._segments.pop(0)[3]
+        if self._readpos is not None and self._readpos[0] == filename:
+            self._readpos = None
+        for seq in [s for s in self._peeked if self._peeked[s][0] == filename]:
+            del self._peeked[seq]
+        try:
+            os.remove(os.path.join(self.path, filename))
+        except OSError as e:
+            self._log.warning("Buffer unable to remove " + filename + ": " + str(e))
+
+    def _close_file(self):
+        if self._file is not None:
+            if self._dirty:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._dirty = False
+            self._file.close()
+            self._file = None
+
+    def _recover(self):
+        """Find the segment files left by a previous run, discarding any cut-short frame."""
+
+        for filename in sorted(os.listdir(self.path)):
+            if not filename.endswith(".seg"):
+                continue
+            path = os.path.join(self.path, filename)
+            first = last = None
+            size = 0
+            with open(path, 'rb') as f:
+                for line in f:
+                    try:
+                        if not line.endswith("\n"):
+                            raise ValueError("incomplete frame")
+                        seq = int(line.split(" ", 1)[0])
+                    except ValueError:
+                        self._log.warning("Buffer " + path + " damaged after frame " + str(last) +
+                                          ", discarding the rest")
+                        break
+                    if first is None:
+                        first = seq
+                    last = seq
+                    size += len(line)
+            if first is None or last <= self._acked:
+                os.remove(path)
+                continue
+            if size < os.path.getsize(path):
+                with open(path, 'r+b') as f:
+                    f.truncate(size)
+            self._segments.append([first, last, size, filename])
+
+    def _read_acked(self):
+        """Return the last acknowledged sequence number saved."""
+
+        try:
+            with open(os.path.join(self.path, "acked")) as f:
+                return int(f.read().strip() or 0)
+        except (IOError, ValueError):
+            return 0
+
+    def _write_acked(self):
+        """Save the last acknowledged sequence number."""
+
+        self._write_file("acked", str(self._acked) + "\n")
+        self._acked_saved = self._acked
+
+    def _read_positions(self):
+        """Return the senders' positions saved, one "<seq> <name>" line each."""
+
+        positions = {}
+        try:
+            with open(os.path.join(self.path, "positions")) as f:
+                lines = f.readlines()
+        except IOError:
+            return positions
+        for line in lines:
+            try:
+                seq, name = line.rstrip("\n").split(" ", 1)
+                positions[name] = int(seq)
+            except ValueError:
+                self._log.warning("Buffer " + self.path + " ignoring damaged position " + repr(line))
+        return positions
+
+    def _write_positions(self):
+        """Save the senders' positions."""
+
+        self._write_file("positions", "".join([str(seq) + " " + name + "\n"
+                                               for name, seq in sorted(self._positions.items())]))
+        self._positions_saved = dict(self._positions)
+
+    def _write_file(self, name, text):
+        """Replace a file in the buffer's directory, so a crash leaves the old or the new one."""
+
+        path = os.path.join(self.path, name)
+        with open(path + ".tmp", 'w') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(path + ".tmp", path)
+        # Make the rename itself (and any segments created or deleted) stick
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
@@ -0,0 +1,228 @@
+"""
+
+  This code is released under the GNU Affero General Public License.
+
+  OpenEnergyMonitor project:
+  http://openenergymonitor.org
+
+"""
+
+import time
+import errno
+import socket
+import httplib
+import logging
+import urlparse
+import threading
+
+"""class EmonHubHTTPPool
+
+Persistent HTTP/1.1 connections, kept open between requests.
+
+Connections are pooled per (scheme, host, port), so posts to the same
+server reuse one TCP (and TLS) connection rather than making a new one
+each time. A connection the server has closed while idle is detected on
+the next request, which is then retried once on a new connection. Only
+failures before any of the reply came back are retried, never timeouts,
+as the server may already have acted on the request.
+
+Safe to use from several threads, each request has a connection of its
+own for its duration.
+
+"""
+
+# Idle connections kept open per server
+POOL_SIZE = 2
+
+# Bytes gathered from a body's pieces before sending them
+BLOCK_SIZE = 16384
+
+
+class EmonHubHTTPPool(object):
+
+    def __init__(self, connect_timeout=10, read_timeout=60):
+
+        # Initialize logger
+        self._log = logging.getLogger("EmonHub")
+
+        self.connect_timeout = float(connect_timeout)
+        self.read_timeout = float(read_timeout)
+        self.size = POOL_SIZE
+
+        # Idle connections, (scheme, host, port): [connection, ...]
+        self._idle = {}
+        self._lock = threading.Lock()
+
+        # Counters
+        self.connects = 0
+        self.requests = 0
+
+    def request(self, url, body=None, headers=None):
+        """Make a request, a POST if there is a body, otherwise a GET.
+
+        body is a string, or a list of strings that are sent in blocks as
+        they come (they are never joined into one string).
+
+        Return (status, reply). Raise httplib.HTTPException or
+        socket.error if the server can't be reached.
+
+        """
+
+        parts = urlparse.urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        method = 'GET' if body is None else 'POST'
+        headers = dict(headers or {})
+        if body is not None and 'Content-Type' not in headers:
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+        conn = self._get(key)
+        reused = conn is not None
+        while True:
+            if conn is None:
+                conn = self._connect(key)
+            sent = False
+            try:
+                self._send(conn, method, path, body, headers)
+                sent = True
+                response = conn.getresponse()
+                reply = response.read()
+            except (httplib.HTTPException, socket.error) as e:
+                conn.close()
+                conn = None
+                if reused and self._stale(e, sent):
+                    # The server closed the idle connection, try once more on a new one
+                    self._log.debug("HTTP connection to " + str(parts.hostname) +
+                                    " lost (" + repr(e) + "), reconnecting")
+                    reused = False
+                    continue
+                raise
+            break
+
+        self.requests += 1
+        if response.will_close:
+            conn.close()
+        else:
+            self._put(key, conn)
+        return response.status, reply
+
+    @staticmethod
+    def _stale(e, sent):
+        """Return True if an error shows the server had closed an idle connection.
+
+        That is a reset or broken pipe while sending, or the connection
+        closing before the status line once sent.
+
+        """
+
+        if isinstance(e, socket.timeout):
+            return False
+        if not sent:
+            return isinstance(e, socket.error) and e.errno in (errno.ECONNRESET, errno.EPIPE)
+        return isinstance(e, httplib.BadStatusLine)
+
+    def _send(self, conn, method, path, body, headers):
+        """Send a request, with the body sent in blocks."""
+
+        conn.putrequest(method, path)
+        for header, value in headers.iteritems():
+            conn.putheader(header, value)
+        if body is not None:
+            if isinstance(body, basestring):
+                body = [body]
+            conn.putheader('Content-Length', str(sum([len(piece) for piece in body])))
+        conn.endheaders()
+
+        if body is None:
+            return
+        block = []
+        size = 0
+        for piece in body:
+            block.append(piece)
+            size += len(piece)
+            if size >= BLOCK_SIZE:
+                conn.send("".join(block))
+                block = []
+                size = 0
+        if block:
+            conn.send("".join(block))
+
+    def close(self):
+        """Close all the idle connections."""
+
+        with self._lock:
+            idle = self._idle
+            self._idle = {}
+        for conns in idle.itervalues():
+            for conn in conns:
+                conn.close()
+
+    def _get(self, key):
+        """Return an idle connection to the server, or None."""
+
+        with self._lock:
+            conns = self._idle.get(key)
+            if conns:
+                return conns.pop()
+        return None
+
+    def _put(self, key, conn):
+        """Keep a connection open for the next request."""
+
+        with self._lock:
+            conns = self._idle.setdefault(key, [])
+            if len(conns) < self.size:
+                conns.append(conn)
+                return
+        conn.close()
+
+    def _connect(self, key):
+        """Open a new connection to the server."""
+
+        scheme, host, port = key
+        if scheme == 'https':
+            conn = httplib.HTTPSConnection(host, port, timeout=self.connect_timeout)
+        else:
+            conn = httplib.HTTPConnection(host, port, timeout=self.connect_timeout)
+        conn.connect()
+        # Once connected, wait up to read_timeout for replies
+        conn.sock.settimeout(self.read_timeout)
+        self.connects += 1
+        return conn
+
+
+"""class EmonHubRateLimiter
+
+A token bucket, limiting something (requests, bytes) to rate per second.
+
+acquire(n) waits until n can be taken. Up to a second's worth can be taken
+at once after a quiet spell, larger amounts are paid for by waiting. A rate
+of 0 means no limit.
+
+"""
+
+class EmonHubRateLimiter(object):
+
+    def __init__(self, rate=0):
+
+        self.rate = float(rate)
+        self._tokens = self.rate
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self, n=1):
+        """Take n, waiting as long as it takes at the set rate."""
+
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.rate, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            # Take them now, any shortfall is waited for below
+            self._tokens -= n
+            wait = -self._tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
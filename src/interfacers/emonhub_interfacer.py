@@ -20,7 +20,10 @@ import uuid
 
 import paho.mqtt.client as mqtt
 
+import traceback
+
 import emonhub_coder as ehc
+import emonhub_bus as ehb
 
 from pydispatch import dispatcher
 
@@ -47,7 +50,8 @@ class EmonHubInterfacer(threading.Thread):
         # Initialise settings
         self.init_settings = {}
         self._defaults = {'pause': 'off', 'interval': 0, 'datacode': '0',
-                          'scale':'1', 'timestamped': False, 'targeted': False, 'nodeoffset' : '0','pubchannels':["ch1"],'subchannels':["ch2"]}
+                          'scale':'1', 'timestamped': False, 'targeted': False, 'nodeoffset' : '0','pubchannels':["ch1"],'subchannels':["ch2"],
+                          'burst': '100', 'queuesize': str(ehb.QUEUE_SIZE), 'overflow': 'dropoldest'}
         self._settings = {}
 
         # This line will stop the default values printing to logfile at start-up
@@ -61,6 +65,16 @@ class EmonHubInterfacer(threading.Thread):
         # create a stop
         self.stop = False
 
+        # Reactor running this interfacer, None if it runs in its own thread
+        self._reactor = None
+
+        # Queue of cargos from the subscribed channels, taken off by this
+        # interfacer's thread (or reactor)
+        self._inbox = ehb.EmonHubQueue()
+        self._consumer = None
+        self._inbox_lost = 0
+        self._inbox_reported = 0
+
     def run(self):
         """
         Run the interfacer.
@@ -70,27 +84,113 @@ class EmonHubInterfacer(threading.Thread):
 
         while not self.stop:
             # Read the input and process data if available
-            rxc = self.read()
-            # if 'pause' in self._settings and \
-            #                 str.lower(self._settings['pause']) in ['all', 'in']:
-            #     pass
-            # else:
-            if rxc:
-                rxc = self._process_rx(rxc)
-                if rxc:
-                    for channel in self._settings["pubchannels"]:
-                        dispatcher.send(channel, cargo=rxc)
-                        self._log.debug(str(rxc.uri) + " Sent to channel' : " + str(channel))
+            self._poll()
+
+            # Pass on the cargos from the subscribed channels
+            self._drain_inbox()
                   
-            # Don't loop to fast
-            time.sleep(0.1)
+            # Don't loop to fast, unless a burst of frames is still waiting
+            # (the wait ends early if a cargo is queued)
+            if not self._rx_pending():
+                self._inbox.wait(0.1)
             # Action reporter tasks
             self.action()
+
+        self._inbox.close()
+        self.close()
+
+    def close(self):
+        """Release what the interfacer holds once it has stopped."""
+
+        pass
+
+    def _poll(self):
+        """Read the input, process it and pass on any valid data."""
+
+        frames = self.read_batch()
+        # if 'pause' in self._settings and \
+        #                 str.lower(self._settings['pause']) in ['all', 'in']:
+        #     pass
+        # else:
+        if frames:
+            for rxc in self._process_rx_batch(frames):
+                self._publish(rxc)
+
+    def _publish(self, rxc, channels=None):
+        """Pass a processed cargo on to the 'pubchannels', or the channels given."""
+
+        if channels is None:
+            channels = self._settings["pubchannels"]
+        for channel in channels:
+            dispatcher.send(channel, cargo=rxc)
+            self._log.debug(str(rxc.uri) + " Sent to channel' : " + str(channel))
    
-    # Subscribed channels entry                 
+    # Subscribed channels entry
+    def _enqueue(self, cargo):
+        """Queue a cargo published to a subscribed channel.
+
+        Called from the publisher's thread, the cargo is passed to receiver()
+        by this interfacer's own thread.
+
+        """
+
+        if self.stop:
+            return
+        if self._inbox.overflow == 'block' and len(self._inbox) >= self._inbox.maxsize and \
+                threading.current_thread().ident == self._consumer:
+            # Can't wait for our own thread to make space, deliver the backlog now
+            self._drain_inbox()
+        if self._inbox.put(cargo) and self._reactor is not None:
+            self._reactor.wake()
+
+    def _drain_inbox(self):
+        """Pass every queued cargo to receiver()."""
+
+        self._consumer = threading.current_thread().ident
+        for cargo in self._inbox.get_all():
+            try:
+                self.receiver(cargo)
+            except Exception:
+                self._log.warning(self.name + " couldn't process cargo, Exception: " +
+                                  traceback.format_exc())
+
+        # Report dropped cargos, at most once a minute
+        lost = self._inbox.dropped + self._inbox.coalesced
+        if lost != self._inbox_lost and time.time() - self._inbox_reported > 60:
+            self._inbox_reported = time.time()
+            self._log.warning(self.name + " queue overflow (" + self._inbox.overflow + "), " +
+                              str(lost - self._inbox_lost) + " cargos dropped or coalesced : " +
+                              str(self._inbox.stats()))
+            self._inbox_lost = lost
+
+    def _queue_settings(self):
+        """Return the validated (queuesize, overflow) settings for the inbox."""
+
+        s = self._settings
+        maxsize = str(s['queuesize']) if 'queuesize' in s else str(ehb.QUEUE_SIZE)
+        overflow = s['overflow'] if 'overflow' in s else 'dropoldest'
+        if not maxsize.isdigit() or int(maxsize) < 1:
+            self._log.warning("'%s' is not valid for %s: queuesize" % (maxsize, self.name))
+            maxsize = self._inbox.maxsize
+        if overflow not in ehb.POLICIES:
+            self._log.warning("'%s' is not valid for %s: overflow" % (overflow, self.name))
+            overflow = self._inbox.overflow
+        return maxsize, overflow
+
+    def _subscribe(self):
+        """Apply the queue settings and subscribe to the 'subchannels'."""
+
+        self._inbox.configure(*self._queue_settings())
+
+        for channel in self._settings["subchannels"]:
+            dispatcher.connect(self._enqueue, channel)
+            self._log.debug(self.name + " Subscribed to channel' : " + str(channel))
+
+    # Subscribed channels cargo, from this interfacer's thread
     def receiver(self, cargo):
         txc = self._process_tx(cargo)
-        self.send(txc)
+        if txc:
+            self.send(txc)
                             
     def read(self):
         """Read raw data from interface and pass for processing.
@@ -100,6 +200,62 @@ class EmonHubInterfacer(threading.Thread):
         pass
 
 
+    def read_batch(self):
+        """Read every frame already waiting at the interface.
+        Drains the interface with up to 'burst' calls to read()
+        Returns a list of EmonHubCargo objects
+        """
+
+        frames = []
+        for i in range(int(self._settings['burst']) if 'burst' in self._settings else 1):
+            rxc = self.read()
+            if rxc:
+                frames.append(rxc)
+            # read() may discard a frame, only stop once nothing is waiting
+            elif not self._rx_pending():
+                break
+        return frames
+
+
+    def _rx_pending(self):
+        """Return True if more received data is waiting to be read.
+        Specific version to be created for each interfacer
+        """
+        return False
+
+
+    def _reactor_fds(self):
+        """Return the file descriptors to watch when run by a reactor,
+        as a tuple of lists (read fds, write fds).
+        Specific version to be created for each interfacer,
+        None means the interfacer can only be run in its own thread
+        """
+        return None
+
+
+    def _on_readable(self, fd):
+        """Called by the reactor when input is ready to be read."""
+        self._poll()
+
+
+    def _on_writable(self, fd):
+        """Called by the reactor when output can be written."""
+        pass
+
+
+    def _run_blocking(self, func, callback=None, *args):
+        """Make a blocking call, func(*args), then callback(result).
+        When run by a reactor, the call is made by one of the reactor's
+        worker threads so the reactor is not held up
+        """
+        if self._reactor is not None:
+            self._reactor.run_in_executor(func, callback, *args)
+            return
+        result = func(*args)
+        if callback is not None:
+            callback(result)
+
+
     def send(self, cargo):
         """Send data from interface.
         Specific version to be created for each interfacer
@@ -134,20 +290,21 @@ class EmonHubInterfacer(threading.Thread):
 
         rxc = cargo
         decoded = []
-        node = str(rxc.nodeid)
-        datacode = True
+        data = rxc.realdata
+        frame = None
 
         # Discard if data is non-existent
-        if len(rxc.realdata) < 1:
-            self._log.warning(str(cargo.uri) + " Discarded RX frame 'string too short' : " + str(rxc.realdata))
+        if len(data) < 1:
+            self._log.warning(str(cargo.uri) + " Discarded RX frame 'string too short' : " + str(data))
             return False
 
-        # Discard if anything non-numerical found
-        try:
-            [float(val) for val in rxc.realdata]
-        except Exception:
-            self._log.warning(str(cargo.uri) + " Discarded RX frame 'non-numerical content' : " + str(rxc.realdata))
-            return False
+        # Discard if anything non-numerical found (binary frames are always bytes)
+        if not isinstance(data, bytearray):
+            try:
+                [float(val) for val in data]
+            except Exception:
+                self._log.warning(str(cargo.uri) + " Discarded RX frame 'non-numerical content' : " + str(data))
+                return False
             
         # Discard if first value is not a valid node id
         # n = float(rxc.realdata[0])
@@ -155,106 +312,66 @@ class EmonHubInterfacer(threading.Thread):
         #     self._log.warning(str(cargo.uri) + " Discarded RX frame 'node id outside scope' : " + str(rxc.realdata))
         #     return False
 
-        # check if node is listed and has individual datacodes for each value
-        if node in ehc.nodelist and 'rx' in ehc.nodelist[node] and 'datacodes' in ehc.nodelist[node]['rx']:
+        # fetch the node's compiled plan, unlisted nodes use the interfacer defaults
+        plan = ehc.registry.rx_plan(rxc.nodeid)
 
-            # fetch the string of datacodes
-            datacodes = ehc.nodelist[node]['rx']['datacodes']
-            
-            # fetch a string of data sizes based on the string of datacodes
-            datasizes = []
-            for code in datacodes:
-                datasizes.append(ehc.check_datacode(str(code)))
+        # check if node has individual datacodes for each value
+        if plan.datacodes is not None:
             # Discard the frame & return 'False' if it doesn't match the summed datasizes
-            if len(rxc.realdata) != sum(datasizes):
-                self._log.warning(str(rxc.uri) + " RX data length: " + str(len(rxc.realdata)) +
-                                  " is not valid for datacodes " + str(datacodes))
+            if len(data) != plan.size:
+                self._log.warning(str(rxc.uri) + " RX data length: " + str(len(data)) +
+                                  " is not valid for datacodes " + str(list(plan.datacodes)))
                 return False
-            else:
-                # Determine the expected number of values to be decoded
-                count = len(datacodes)
-                # Set decoder to "Per value" decoding using datacode 'False' as flag
-                datacode = False
+            frame = plan.struct
         else:
             # if node is listed, but has only a single default datacode for all values
-            if node in ehc.nodelist and 'rx' in ehc.nodelist[node] and 'datacode' in ehc.nodelist[node]['rx']:
-                datacode = ehc.nodelist[node]['rx']['datacode']
+            if plan.datacode is not None:
+                datacode = plan.datacode
             else:
             # when node not listed or has no datacode(s) use the interfacers default if specified
                 datacode = self._settings['datacode']
-            # Ensure only int 0 is passed not str 0
-            if datacode == '0':
-                datacode = 0
             # when no (default)datacode(s) specified, pass string values back as numerical values
-            if not datacode:
-                for val in rxc.realdata:
+            if str(datacode) == '0':
+                for val in data:
                     if float(val) % 1 != 0:
                         val = float(val)
                     else:
                         val = int(float(val))
                     decoded.append(val)
-            # Discard frame if total size is not an exact multiple of the specified datacode size.
-            elif len(rxc.realdata) % ehc.check_datacode(datacode) != 0:
-                self._log.warning(str(rxc.uri) + " RX data length: " + str(len(rxc.realdata)) +
-                                  " is not valid for datacode " + str(datacode))
-                return False
             else:
-            # Determine the number of values in the frame of the specified code & size
-                count = len(rxc.realdata) / ehc.check_datacode(datacode)
-
-        # Decode the string of data one value at a time into "decoded"
-        if not decoded:
-            bytepos = int(0)
-            for i in range(0, count, 1):
-                # Use single datacode unless datacode = False then use datacodes
-                dc = str(datacode)
-                if not datacode:
-                    dc = str(datacodes[i])
-                # Determine the number of bytes to use for each value by it's datacode
-                size = int(ehc.check_datacode(dc))
-                try:
-                    value = ehc.decode(dc, [int(v) for v in rxc.realdata[bytepos:bytepos+size]])
-                except:
-                    self._log.warning(str(rxc.uri) + " Unable to decode as values incorrect for datacode(s)")
+                # Discard frame if total size is not an exact multiple of the specified datacode size.
+                frame = plan.frame_struct(str(datacode), len(data))
+                if frame is None:
+                    self._log.warning(str(rxc.uri) + " RX data length: " + str(len(data)) +
+                                      " is not valid for datacode " + str(datacode))
                     return False
-                bytepos += size
-                decoded.append(value)
 
-        # check if node is listed and has individual scales for each value
-        if node in ehc.nodelist and 'rx' in ehc.nodelist[node] and 'scales' in ehc.nodelist[node]['rx']:
-            scales = ehc.nodelist[node]['rx']['scales']
+        # Decode the whole frame of data in one pass
+        if frame is not None:
+            try:
+                decoded = list(frame.unpack_from(self._frame_bytes(data)))
+            except Exception:
+                self._log.warning(str(rxc.uri) + " Unable to decode as values incorrect for datacode(s)")
+                return False
+
+        # check if node has individual scales for each value
+        if plan.scales is not None:
             # Discard the frame & return 'False' if it doesn't match the number of scales
-            if len(decoded) != len(scales):
-                self._log.warning(str(rxc.uri) + " Scales " + str(scales) + " for RX data : " + str(rxc.realdata) +
+            if len(decoded) != len(plan.scales):
+                self._log.warning(str(rxc.uri) + " Scales " + str(ehc.describe_scales(plan.scales)) + " for RX data : " + str(data) +
                                   " not suitable " )
                 return False
-            else:
-                # Determine the expected number of values to be decoded
-
-                # Set decoder to "Per value" scaling using scale 'False' as flag
-                scale = False
+            ehc.scale_values(decoded, plan.scales)
         else:
             # if node is listed, but has only a single default scale for all values
-            if node in ehc.nodelist and 'rx' in ehc.nodelist[node] and 'scale' in ehc.nodelist[node]['rx']:
-                scale = ehc.nodelist[node]['rx']['scale']
+            if plan.hasscale:
+                scale = plan.scale
             else:
             # when node not listed or has no scale(s) use the interfacers default if specified
-                scale = self._settings['scale']
-
-
-        if not scale == "1":
-            for i in range(0, len(decoded), 1):
-                x = scale
-                if not scale:
-                    x = scales[i]
-                
-                if x != "1":
-                    val = decoded[i] * float(x)
-                    if val % 1 == 0:
-                        decoded[i] = int(val)
-                    else:
-                        decoded[i] = float(val)
-                        
+                scale = ehc.scale_factor(self._settings['scale'])
+            if scale is not None:
+                ehc.scale_values(decoded, [scale] * len(decoded))
+
         rxc.realdata = decoded
 
         if not rxc:
@@ -270,6 +387,108 @@ class EmonHubInterfacer(threading.Thread):
         return rxc
 
 
+    def _process_rx_batch(self, frames):
+        """Process a list of received frames, in order.
+
+        Consecutive frames from the same node with the same length are
+        decoded together in one pass (vectorised when NumPy is available),
+        anything else is processed frame by frame by _process_rx.
+
+        Return a list of the valid processed cargos.
+
+        """
+
+        processed = []
+        i = 0
+        while i < len(frames):
+            # Find the run of frames matching this one's node & length
+            first = frames[i]
+            j = i + 1
+            while j < len(frames) and frames[j].nodeid == first.nodeid and \
+                    len(frames[j].realdata) == len(first.realdata):
+                j += 1
+            group = frames[i:j]
+            i = j
+
+            layout = None
+            # Empty frames (eg a bare "OK 5") have nothing to decode, _process_rx
+            # deals with them
+            if len(group) > 1 and len(first.realdata):
+                layout = self._batch_layout(first.nodeid, len(first.realdata))
+            if layout is not None:
+                frame, factors = layout
+                try:
+                    buf = bytearray()
+                    for rxc in group:
+                        buf.extend(self._frame_bytes(rxc.realdata))
+                except Exception:
+                    # leave the faulty frame(s) to be reported individually
+                    layout = None
+
+            if layout is None:
+                for rxc in group:
+                    rxc = self._process_rx(rxc)
+                    if rxc:
+                        processed.append(rxc)
+                continue
+
+            for rxc, values in zip(group, ehc.decode_batch(frame, buf, len(group), factors)):
+                rxc.realdata = values
+                processed.append(rxc)
+            self._log.debug(str(first.uri) + " to " + str(group[-1].uri) + " batch decoded " +
+                            str(len(group)) + " frames from node " + str(first.nodeid))
+
+        return processed
+
+
+    def _batch_layout(self, nodeid, length):
+        """Return the frame struct & scale factors to batch decode a node's frames.
+
+        Return None if the frames can't be batch decoded, they are then
+        processed (and any problem reported) one at a time.
+
+        """
+
+        plan = ehc.registry.rx_plan(nodeid)
+
+        if plan.datacodes is not None:
+            if length != plan.size:
+                return None
+            frame = plan.struct
+            count = len(plan.datacodes)
+        else:
+            datacode = plan.datacode
+            if datacode is None:
+                datacode = self._settings['datacode']
+            if str(datacode) == '0':
+                return None
+            frame = plan.frame_struct(str(datacode), length)
+            if frame is None:
+                return None
+            count = length // ehc.check_datacode(str(datacode))
+
+        if plan.scales is not None:
+            if len(plan.scales) != count:
+                return None
+            factors = plan.scales
+        else:
+            if plan.hasscale:
+                scale = plan.scale
+            else:
+                scale = ehc.scale_factor(self._settings['scale'])
+            factors = [scale] * count
+
+        return frame, factors
+
+
+    def _frame_bytes(self, data):
+        """Return a frame's list of byte values as a bytearray for decoding."""
+
+        if isinstance(data, bytearray):
+            return data
+        return bytearray([int(v) for v in data])
+
+
     def _process_tx(self, cargo):
         """Prepare data for outgoing transmission.
         cargo is passed through this chain of processing to scale
@@ -281,132 +500,32 @@ class EmonHubInterfacer(threading.Thread):
         encode data for other targets.
 
         New "encoded" data is stored as a list of {interfacer:encoded-data} dicts.
+        Interfacers that encode identically share the same encoded data.
 
         Returns cargo.
         """
 
         txc = cargo
-        scaled = []
-        encoded = []
         
         # Normal operation is dest from txc.nodeid
         if txc.target:
-            dest = str(txc.target)
-            # self._log.info("dest from txc.target: "+dest)
+            dest = txc.target
         else:
-            dest = str(txc.nodeid)
-            # self._log.info("dest from txc.nodeid: "+dest)
-        
-        # self._log.info("Target: "+dest)
-        # self._log.info("Realdata: "+json.dumps(txc.realdata))
+            dest = txc.nodeid
 
-        # check if node is listed and has individual scales for each value
-        if dest in ehc.nodelist and 'tx' in ehc.nodelist[dest] and 'scales' in ehc.nodelist[dest]['tx']:
-            scales = ehc.nodelist[dest]['tx']['scales']
-            # Discard the frame & return 'False' if it doesn't match the number of scales
-            if len(txc.realdata) != len(scales):
-                self._log.warning(str(txc.uri) + " Scales " + str(scales) + " for RX data : " + str(txc.realdata) +
-                                  " not suitable " )
-                return False
-            else:
-                # Determine the expected number of values to be decoded
+        # when no datacode or scale specified use the interfacers defaults if specified
+        datacode = self._settings['datacode'] if 'datacode' in self._settings else "h"
+        scale = self._settings['scale'] if 'scale' in self._settings else "1"
 
-                # Set decoder to "Per value" scaling using scale 'False' as flag
-                scale = False
-        else:
-            # if node is listed, but has only a single default scale for all values
-            if dest in ehc.nodelist and 'tx' in ehc.nodelist[dest] and 'scale' in ehc.nodelist[dest]['tx']:
-                scale = ehc.nodelist[dest]['tx']['scale']
-            else:
-            # when node not listed or has no scale(s) use the interfacers default if specified
-                if 'scale' in self._settings:
-                    scale = self._settings['scale']
-                else: 
-                    scale = "1"
-
-        if scale == "1":
-            scaled = txc.realdata
-        else:
-            for i in range(0, len(txc.realdata), 1):
-                x = scale
-                if not scale:
-                    x = scales[i]
-                if x == "1":
-                    val = txc.realdata[i]
-                else:
-                    val = float(txc.realdata[i]) / float(x)
-                    if val % 1 == 0:
-                        val = int(val)
-                scaled.append(val)
-
-        
-        # self._log.info("Scaled: "+json.dumps(scaled))
-
-        # check if node is listed and has individual datacodes for each value
-        if (dest in ehc.nodelist and 'tx' in ehc.nodelist[dest] and 'datacodes' in ehc.nodelist[dest]['tx']):
-
-            # fetch the string of datacodes
-            datacodes = ehc.nodelist[dest]['tx']['datacodes']
-            
-            # fetch a string of data sizes based on the string of datacodes
-            datasizes = []
-            for code in datacodes:
-                datasizes.append(ehc.check_datacode(str(code)))
-            # Discard the frame & return 'False' if it doesn't match the summed datasizes
-            if len(scaled) != len(datasizes):
-                self._log.warning(str(txc.uri) + " TX datacodes: " + str(datacodes) +
-                                  " are not valid for values " + str(scaled))
-                return False
-            else:
-                # Determine the expected number of values to be decoded
-                count = len(scaled)
-                # Set decoder to "Per value" decoding using datacode 'False' as flag
-                datacode = False
-        else:
-            # if node is listed, but has only a single default datacode for all values
-            if dest in ehc.nodelist and 'tx' in ehc.nodelist[dest] and 'datacode' in ehc.nodelist[dest]['tx']:
-                datacode = ehc.nodelist[dest]['tx']['datacode']
-            else:
-            # when node not listed or has no datacode(s) use the interfacers default if specified
-                if 'datacode' in self._settings:
-                    datacode = self._settings['datacode']
-                else:
-                    datacode = "h"
-                    
-            # Ensure only int 0 is passed not str 0
-            if datacode == '0':
-                datacode = 0
-            # when no (default)datacode(s) specified, pass string values back as numerical values
-            if not datacode:
-                encoded.append(dest)
-                
-                for val in scaled:
-                    if float(val) % 1 != 0:
-                        val = float(val)
-                    else:
-                        val = int(float(val))
-                    encoded.append(val)
-            # Discard frame if total size is not an exact multiple of the specified datacode size.
-            # elif len(data) * ehc.check_datacode(datacode) != 0:
-            #     self._log.warning(str(uri) + " TX data length: " + str(len(data)) +
-            #                       " is not valid for datacode " + str(datacode))
-            #     return False
-            else:
-            # Determine the number of values in the frame of the specified code & size
-                count = len(scaled) #/ ehc.check_datacode(datacode)
-
-        if not encoded:
-            encoded.append(dest)
-            for i in range(0, count, 1):
-                # Use single datacode unless datacode = False then use datacodes
-                dc = str(datacode)
-                if not datacode:
-                    dc = str(datacodes[i])
-                
-                for b in ehc.encode(dc,int(scaled[i])):
-                    encoded.append(b)
-
-        # self._log.info("Encoded: "+json.dumps(encoded))
+        try:
+            plan = ehc.registry.tx_plan(dest, datacode, scale)
+            # Encode only once per plan, other subscribers reuse the result
+            encoded = txc.encodings.get(plan)
+            if encoded is None:
+                encoded = txc.encodings[plan] = plan.encode(txc.realdata)
+        except ValueError as e:
+            self._log.warning(str(txc.uri) + " " + str(e))
+            return False
 
         txc.encoded.update({self.getName():encoded})
         return txc
@@ -444,6 +563,12 @@ class EmonHubInterfacer(threading.Thread):
                 pass
             elif key == 'nodeoffset' and str(setting).isdigit():
                 pass
+            elif key == 'burst' and str(setting).isdigit() and int(setting) > 0:
+                pass
+            elif key == 'queuesize' and str(setting).isdigit() and int(setting) > 0:
+                pass
+            elif key == 'overflow' and setting in ehb.POLICIES:
+                pass
             elif key == 'datacode' and str(setting) in ['0', 'b', 'B', 'h', 'H', 'L', 'l', 'f']:
                 pass
             elif key == 'scale' and (int(setting == 1) or not (int(setting % 10))):
@@ -466,10 +591,7 @@ class EmonHubInterfacer(threading.Thread):
             self._settings[key] = setting
             self._log.debug("Setting " + self.name + " " + key + ": " + str(setting))
 
-            # Is there a better place to put this?    
-            for channel in self._settings["subchannels"]:
-                dispatcher.connect(self.receiver, channel)
-                self._log.debug("Interfacer: Subscribed to channel' : " + str(channel))
+        self._subscribe()
 
 
 """class EmonHubInterfacerInitError
@@ -0,0 +1,127 @@
+"""Tests for EmonHubDiskBuffer reopening what a previous run left behind.
+
+Run from the repository root with: python -m unittest discover tests
+
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'interfacers'))
+
+from emonhub_buffer import EmonHubDiskBuffer
+
+
+class DiskBufferTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def segments(self):
+        return sorted([f for f in os.listdir(self.path) if f.endswith('.seg')])
+
+    def test_truncated_tail_segment(self):
+        buf = EmonHubDiskBuffer(self.path, 1000000)
+        buf.put(['[%d,1,2]' % i for i in range(10)])
+        buf.close()
+
+        # A crash part way through writing frame 11
+        segment = os.path.join(self.path, self.segments()[-1])
+        size = os.path.getsize(segment)
+        with open(segment, 'ab') as f:
+            f.write('11 [10,1')
+
+        buf = EmonHubDiskBuffer(self.path, 1000000)
+        self.assertEqual(len(buf), 10)
+        self.assertEqual(buf.peek()[-1], (10, '[9,1,2]'))
+        self.assertEqual(os.path.getsize(segment), size)
+        self.assertEqual(buf.put(['[10,1,2]']), 11)
+        self.assertEqual(buf.peek(after=10), [(11, '[10,1,2]')])
+        buf.close()
+
+    def test_acks_saved_by_sync(self):
+        buf = EmonHubDiskBuffer(self.path, 1000000)
+        buf.put(['[%d,1,2]' % i for i in range(10)])
+        buf.sync()
+        buf.ack_through(4)
+        self.assertEqual(buf.peek(1), [(5, '[4,1,2]')])
+
+        # Not synced yet, so a crash sends frames 1 to 4 again
+        reopened = EmonHubDiskBuffer(self.path, 1000000)
+        self.assertEqual(reopened.acked(), 0)
+        self.assertEqual(len(reopened), 10)
+
+        buf.ack_through(10)
+        buf.sync()
+        self.assertEqual(self.segments(), [])
+        buf.close()
+        reopened = EmonHubDiskBuffer(self.path, 1000000)
+        self.assertEqual((reopened.acked(), len(reopened)), (10, 0))
+        # Sequence numbers carry on from the last acknowledged
+        self.assertEqual(reopened.put(['[10,1,2]']), 11)
+        reopened.close()
+
+    def test_positions(self):
+        buf = EmonHubDiskBuffer(self.path, 1000000)
+        buf.put(['[%d,1,2]' % i for i in range(10)])
+        buf.save_positions({'http://a': 7, 'http://b': 3})
+        buf.close()
+        self.assertFalse(os.path.exists(os.path.join(self.path, 'positions.tmp')))
+        self.assertEqual(EmonHubDiskBuffer(self.path, 1000000).positions(),
+                         {'http://a': 7, 'http://b': 3})
+
+    def test_missing_positions(self):
+        buf = EmonHubDiskBuffer(self.path, 1000000)
+        buf.put(['[%d,1,2]' % i for i in range(10)])
+        buf.save_positions({'http://a': 7})
+        buf.close()
+        os.remove(os.path.join(self.path, 'positions'))
+
+        buf = EmonHubDiskBuffer(self.path, 1000000)
+        self.assertEqual(buf.positions(), {})
+        self.assertEqual(len(buf), 10)
+        buf.close()
+
+    def test_corrupt_positions(self):
+        buf = EmonHubDiskBuffer(self.path, 1000000)
+        buf.put(['[%d,1,2]' % i for i in range(10)])
+        buf.close()
+        with open(os.path.join(self.path, 'positions'), 'wb') as f:
+            f.write('\x00\x00\x00\n7 http://a\nx http://b\n')
+
+        buf = EmonHubDiskBuffer(self.path, 1000000)
+        self.assertEqual(buf.positions(), {'http://a': 7})
+        self.assertEqual(len(buf), 10)
+        buf.close()
+
+    def test_eviction_drops_oldest(self):
+        # 4096 byte segments, frames of 100 bytes
+        buf = EmonHubDiskBuffer(self.path, 32768)
+        frame = '[%04d,' + 'x' * 90 + ']'
+        for i in range(1, 1001):
+            buf.put([frame % i])
+            self.assertLessEqual(buf.size(), 32768)
+
+        # What's left is the newest frames, in order, with no gaps
+        frames = buf.peek()
+        seqs = [seq for seq, f in frames]
+        self.assertEqual(seqs, range(seqs[0], 1001))
+        self.assertEqual([f for seq, f in frames], [frame % seq for seq in seqs])
+        self.assertEqual(buf.acked(), seqs[0] - 1)
+        self.assertEqual(buf.dropped, seqs[0] - 1)
+        buf.close()
+
+        reopened = EmonHubDiskBuffer(self.path, 32768)
+        self.assertEqual(reopened.peek(), frames)
+        self.assertEqual(reopened.put([frame % 1001]), 1001)
+        reopened.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
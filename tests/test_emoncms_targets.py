@@ -0,0 +1,193 @@
+"""Tests for the EmonHubEmoncmsTarget of an EmonHubEmoncmsHTTPInterfacer
+posting to local stub servers.
+
+The targets' posts are made from the test's thread, one _send() at a time,
+rather than from their own threads.
+
+Run from the repository root with: python -m unittest discover tests
+
+"""
+
+import os
+import sys
+import json
+import logging
+import unittest
+import threading
+import SocketServer
+import BaseHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'interfacers'))
+
+from EmonHubEmoncmsHTTPInterfacer import EmonHubEmoncmsHTTPInterfacer
+from Cargo import new_cargo
+
+logging.getLogger("EmonHub").addHandler(logging.NullHandler())
+
+APIKEY = '0123456789abcdef0123456789abcdef'
+
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Records the frames of each bulk post, or fails them while server.down is set."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        length = int(self.headers.getheader('Content-Length', 0))
+        body = self.rfile.read(length)
+        if self.server.down:
+            reply = 'down'
+            self.send_response(500)
+        else:
+            data = body.split('&sentat=')[0][len('data='):]
+            self.server.posts.append([frame[2] for frame in json.loads(data)])
+            reply = 'ok'
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), StubHandler)
+        self.down = False
+        self.posts = []
+        self.url = 'http://127.0.0.1:%d' % self.server_address[1]
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def frames(self):
+        return [value for post in self.posts for value in post]
+
+
+class EmoncmsTargetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.servers = [StubServer(), StubServer()]
+        self.count = 0
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def interfacer(self, servers, **settings):
+        I = EmonHubEmoncmsHTTPInterfacer('emoncms')
+        kwargs = {'url': [server.url for server in servers], 'apikey': APIKEY,
+                  'maxframes': '10', 'maxage': '60', 'workers': '1', 'read_timeout': '5'}
+        kwargs.update(settings)
+        I.set(**kwargs)
+        return I
+
+    def receive(self, I, n):
+        """Receive n frames, values counting up from 0, and store them in the buffer."""
+
+        for i in range(n):
+            I.receiver(new_cargo(realdata=[self.count], nodeid=5))
+            self.count += 1
+        I._swap()
+
+    def post(self, target):
+        """Have a target post what is waiting now, whenever it last posted or failed."""
+
+        target._retry_at = 0
+        target.lastsent = 0
+        target._send()
+
+    def test_failing_target_doesnt_hold_back_another(self):
+        up, down = self.servers
+        down.down = True
+        I = self.interfacer([up, down])
+        target_up, target_down = I._targets
+
+        for n in range(3):
+            self.receive(I, 10)
+            self.post(target_up)
+            self.post(target_down)
+
+        self.assertEqual(up.frames(), range(30))
+        self.assertEqual(down.frames(), [])
+        self.assertEqual((target_up.acked, target_down.acked), (30, 0))
+
+        # Recovered, the failing target catches up on its own
+        down.down = False
+        self.post(target_down)
+        self.assertEqual(sorted(down.frames()), range(30))
+        self.assertEqual(up.frames(), range(30))
+
+    def test_acked_through_slowest_target(self):
+        fast, slow = self.servers
+        I = self.interfacer([fast, slow])
+        target_fast, target_slow = I._targets
+
+        self.receive(I, 10)
+        self.post(target_fast)
+        self.post(target_slow)
+        self.assertEqual(I.buffer.acked(), 10)
+
+        slow.down = True
+        self.receive(I, 20)
+        self.post(target_fast)
+        self.post(target_slow)
+        self.assertEqual((target_fast.acked, target_slow.acked), (30, 10))
+        # Kept for the slow target, with each target's position
+        self.assertEqual(I.buffer.acked(), 10)
+        self.assertEqual(len(I.buffer), 20)
+        self.assertEqual(I.buffer.positions(), {target_fast.key: 30, target_slow.key: 10})
+
+        slow.down = False
+        self.post(target_slow)
+        self.assertEqual(I.buffer.acked(), 30)
+        self.assertEqual(len(I.buffer), 0)
+
+    def test_catch_up_posts_live_frames_first(self):
+        server = self.servers[0]
+        I = self.interfacer([server])
+        target = I._targets[0]
+
+        # An outage, with a backlog building up
+        server.down = True
+        for n in range(5):
+            self.receive(I, 10)
+            self.post(target)
+        self.assertEqual(server.posts, [])
+
+        # Back up, the frames just received go ahead of the backlog
+        server.down = False
+        self.receive(I, 5)
+        self.post(target)
+
+        self.assertEqual(server.posts[0], range(50, 55))
+        self.assertEqual(server.frames()[5:], range(50))
+        self.assertEqual(I.buffer.acked(), 55)
+
+    def test_catch_up_with_no_maxage(self):
+        server = self.servers[0]
+        I = self.interfacer([server], maxage='0')
+        target = I._targets[0]
+
+        server.down = True
+        self.receive(I, 50)
+        self.post(target)
+
+        # Every post is due straight away, yet the backlog still goes down
+        server.down = False
+        self.receive(I, 5)
+        for n in range(5):
+            backlog = target.stats()['backlog']
+            self.post(target)
+            self.assertLess(target.stats()['backlog'], backlog)
+        self.assertEqual(sorted(server.frames()), range(55))
+
+
+if __name__ == '__main__':
+    unittest.main()
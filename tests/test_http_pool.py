@@ -0,0 +1,102 @@
+"""Tests for EmonHubHTTPPool against a local stub server.
+
+Run from the repository root with: python -m unittest discover tests
+
+"""
+
+import os
+import sys
+import time
+import socket
+import unittest
+import threading
+import SocketServer
+import BaseHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'interfacers'))
+
+from emonhub_http import EmonHubHTTPPool
+
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Replies 'ok' to every request over persistent HTTP/1.1 connections."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections.append(self.connection)
+
+    def do_POST(self):
+        length = int(self.headers.getheader('Content-Length', 0))
+        self.server.bodies.append(self.rfile.read(length))
+        if self.path.endswith('/slow'):
+            time.sleep(2)
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write('ok')
+
+    do_GET = do_POST
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+
+class HTTPPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer(('127.0.0.1', 0), StubHandler)
+        self.server.connections = []
+        self.server.bodies = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.base = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.url = self.base + '/input/bulk.json'
+        self.pool = EmonHubHTTPPool(connect_timeout=5, read_timeout=5)
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_posts_share_one_connection(self):
+        for i in range(5):
+            status, reply = self.pool.request(self.url, 'data=[[%d,1,2]]' % i)
+            self.assertEqual((status, reply), (200, 'ok'))
+        self.assertEqual(len(self.server.bodies), 5)
+        self.assertEqual(len(self.server.connections), 1)
+        self.assertEqual(self.pool.connects, 1)
+
+    def test_body_in_pieces(self):
+        pieces = ['data=[', '[0,1,2]', ',[1,1,2]', ']']
+        self.assertEqual(self.pool.request(self.url, pieces), (200, 'ok'))
+        self.assertEqual(self.server.bodies, [''.join(pieces)])
+
+    def test_reconnects_after_server_closes(self):
+        self.assertEqual(self.pool.request(self.url, 'data=[]'), (200, 'ok'))
+        for conn in self.server.connections:
+            conn.shutdown(socket.SHUT_RDWR)
+        self.assertEqual(self.pool.request(self.url, 'data=[]'), (200, 'ok'))
+        self.assertEqual(len(self.server.connections), 2)
+        self.assertEqual(self.pool.connects, 2)
+
+    def test_timeout_not_retried(self):
+        self.pool.read_timeout = 0.5
+        self.assertEqual(self.pool.request(self.url, 'data=[]'), (200, 'ok'))
+        # The server may have acted on a request that timed out, so it isn't sent again
+        self.assertRaises(socket.timeout, self.pool.request, self.base + '/slow', 'data=[[0,1,2]]')
+        time.sleep(0.5)
+        self.assertEqual(len(self.server.bodies), 2)
+        self.assertEqual(len(self.server.connections), 1)
+        self.assertEqual(self.pool.connects, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+"""Tests for the bulk messages received by EmonHubMqttInterfacer.
+
+Run from the repository root with: python -m unittest discover tests
+
+"""
+
+import os
+import sys
+import json
+import struct
+import logging
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'interfacers'))
+
+from pydispatch import dispatcher
+from EmonHubMqttInterfacer import EmonHubMqttInterfacer, BULK_HEADER
+
+logging.getLogger("EmonHub").addHandler(logging.NullHandler())
+
+
+def binary_frame(timestamp, nodeid, values):
+    return BULK_HEADER.pack(timestamp, nodeid, len(values)) + struct.pack('<%dd' % len(values), *values)
+
+
+class Message(object):
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class MqttBulkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mqtt = EmonHubMqttInterfacer('mqtt')
+        self.mqtt.set(pubchannels=['test-radio'], bulkchannels=['test-store'])
+        self.radio = []
+        self.store = []
+        dispatcher.connect(self.radio_receiver, 'test-radio')
+        dispatcher.connect(self.store_receiver, 'test-store')
+
+    def tearDown(self):
+        dispatcher.disconnect(self.radio_receiver, 'test-radio')
+        dispatcher.disconnect(self.store_receiver, 'test-store')
+        self.mqtt.close()
+
+    def radio_receiver(self, cargo):
+        self.radio.append(cargo)
+
+    def store_receiver(self, cargo):
+        self.store.append(cargo)
+
+    def frames(self, cargos):
+        return [(c.timestamp, c.nodeid, c.realdata) for c in cargos]
+
+    def test_json(self):
+        payload = json.dumps([[1500000000, 10, 1, 2.5, -3], [1500000001, 11, 4.0]])
+        cargos = self.mqtt._bulk_cargos(payload, False)
+        self.assertEqual(self.frames(cargos), [(1500000000.0, 10, [1, 2.5, -3]),
+                                               (1500000001.0, 11, [4])])
+        # Whole values are ints
+        self.assertEqual([type(v) for v in cargos[0].realdata], [int, float, int])
+
+    def test_binary(self):
+        payload = binary_frame(1500000000, 10, [1, 2.5, -3]) + binary_frame(1500000001, 11, [4])
+        cargos = self.mqtt._bulk_cargos(payload, True)
+        self.assertEqual(self.frames(cargos), [(1500000000.0, 10, [1, 2.5, -3]),
+                                               (1500000001.0, 11, [4])])
+
+    def test_truncated_binary(self):
+        payload = binary_frame(1500000000, 10, [1, 2]) + binary_frame(1500000001, 11, [3, 4])
+        for size in [len(payload) - 1, BULK_HEADER.size + 20, BULK_HEADER.size - 1]:
+            self.assertRaises(struct.error, self.mqtt._bulk_cargos, payload[:size], True)
+
+    def test_frames_without_values(self):
+        payload = json.dumps([[1500000000, 10], [1500000001, 11, 7]])
+        self.assertEqual(self.frames(self.mqtt._bulk_cargos(payload, False)),
+                         [(1500000001.0, 11, [7])])
+        payload = binary_frame(1500000000, 10, []) + binary_frame(1500000001, 11, [7])
+        self.assertEqual(self.frames(self.mqtt._bulk_cargos(payload, True)),
+                         [(1500000001.0, 11, [7])])
+
+    def test_bulk_goes_to_bulkchannels(self):
+        self.mqtt.on_message(None, None, Message('emonhub/tx/bulk', json.dumps([[1500000000, 10, 1, 2]])))
+        self.mqtt.on_message(None, None, Message('emonhub/tx/bulk/binary', binary_frame(1500000001, 11, [3])))
+        self.assertEqual(self.frames(self.store),
+                         [(1500000000.0, 10, [1, 2]), (1500000001.0, 11, [3])])
+        self.assertEqual(self.radio, [])
+
+        # A damaged message is discarded whole
+        self.mqtt.on_message(None, None, Message('emonhub/tx/bulk/binary', binary_frame(1500000002, 12, [5])[:-1]))
+        self.mqtt.on_message(None, None, Message('emonhub/tx/bulk', '[[1500000003, 13, 6]'))
+        self.assertEqual(len(self.store), 2)
+
+        # Frames to send on still go to the pubchannels
+        self.mqtt.on_message(None, None, Message('emonhub/tx/5/values', '1,2'))
+        self.assertEqual([c.nodeid for c in self.radio], [5])
+
+
+if __name__ == '__main__':
+    unittest.main()
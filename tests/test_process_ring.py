@@ -0,0 +1,57 @@
+"""Tests for EmonHubFrameRing, the frames shared with a child process.
+
+Run from the repository root with: python -m unittest discover tests
+
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from emonhub_process import EmonHubFrameRing, MAX_VALUES
+from interfacers.Cargo import new_cargo
+
+
+class FrameRingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.ring = EmonHubFrameRing(slots=4)
+
+    def test_round_trip(self):
+        cargo = new_cargo(realdata=[1, -2, 3.5, 0.1, 2 ** 40], nodeid=10,
+                          timestamp=1500000000.25, target=5, rssi=-70)
+        self.assertTrue(EmonHubFrameRing.fits(cargo))
+        self.assertTrue(self.ring.put(cargo, 0))
+
+        rxc = self.ring.get(0)
+        self.assertEqual(rxc.realdata, [1, -2, 3.5, 0.1, 2 ** 40])
+        self.assertEqual([type(v) for v in rxc.realdata], [int, int, float, float, int])
+        self.assertEqual(rxc.nodeid, 10)
+        self.assertEqual(rxc.timestamp, 1500000000.25)
+        self.assertEqual(rxc.target, 5)
+        self.assertEqual(rxc.rssi, -70)
+        self.assertIsNone(self.ring.get(0))
+
+    def test_order_and_full(self):
+        for n in range(4):
+            self.assertTrue(self.ring.put(new_cargo(realdata=[n], nodeid=n), 0))
+        self.assertFalse(self.ring.put(new_cargo(realdata=[4], nodeid=4), 0))
+
+        self.assertEqual(self.ring.get(0).realdata, [0])
+        self.assertTrue(self.ring.put(new_cargo(realdata=[4], nodeid=4), 0))
+        self.assertEqual([self.ring.get(0).realdata[0] for n in range(4)], [1, 2, 3, 4])
+
+    def test_frames_that_dont_fit(self):
+        # Integers a double would round go through the pipe
+        self.assertTrue(EmonHubFrameRing.fits(new_cargo(realdata=[2 ** 53, -2 ** 53])))
+        self.assertFalse(EmonHubFrameRing.fits(new_cargo(realdata=[2 ** 53 + 1])))
+        self.assertFalse(EmonHubFrameRing.fits(new_cargo(realdata=[2 ** 64 - 1])))
+        self.assertFalse(EmonHubFrameRing.fits(new_cargo(realdata=[-2 ** 63])))
+        self.assertFalse(EmonHubFrameRing.fits(new_cargo(realdata=['on'])))
+        self.assertFalse(EmonHubFrameRing.fits(new_cargo(realdata=[0] * (MAX_VALUES + 1))))
+
+
+if __name__ == '__main__':
+    unittest.main()